@@ -0,0 +1,15 @@
+import sys
+from os.path import dirname, abspath
+
+import pytest
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from tools.local_api import LocalAPIServer
+
+
+@pytest.fixture
+def server():
+    server = LocalAPIServer(rows=500).start()
+    yield server
+    server.stop()
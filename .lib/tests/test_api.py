@@ -0,0 +1,233 @@
+import gzip, json, random, threading, zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from requests.exceptions import ConnectionError, HTTPError
+
+from tools import api
+from tools.api import AAPSClient, JSONStreamDecoder, StreamDecompressor, PartialDownload
+from tools.local_api import local_token, make_record
+
+
+def expected_records(set_key, rows, seed=0):
+    rnd = random.Random(seed)
+    return [make_record(set_key, i, rnd) for i in range(rows)]
+
+
+def feed_chunks(decoder, body, size):
+    records = []
+    for i in range(0, len(body), size):
+        records += decoder.feed(body[i:i+size])
+    return records + decoder.close()
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+def test_decoder_array_split_anywhere(size):
+    records = [dict(id=i, name='Año ñandú €', values=[i, None, {'x': 'y]'}]) for i in range(50)]
+    body = json.dumps(records).encode()
+    assert feed_chunks(JSONStreamDecoder(), body, size) == records
+
+
+def test_decoder_ndjson():
+    records = [dict(id=i, text=f'línea {i}') for i in range(20)]
+    body = ''.join(json.dumps(r) + '\n' for r in records).encode()
+    assert feed_chunks(JSONStreamDecoder(ndjson=True), body, 5) == records
+
+
+def test_decoder_document_and_truncated_array():
+    decoder = JSONStreamDecoder()
+    assert feed_chunks(decoder, b'{"detail": "Token inv\xc3\xa1lido."}', 3) == []
+    assert decoder.document == {'detail': 'Token inválido.'}
+
+    decoder = JSONStreamDecoder()
+    decoder.feed(b'[{"a": 1}, {"a": 2}')
+    with pytest.raises(ValueError):
+        decoder.close()
+
+
+@pytest.mark.parametrize('body', [b'', b'  \r\n'])
+def test_decoder_empty_body(body):
+    decoder = JSONStreamDecoder()
+    decoder.feed(body)
+    with pytest.raises(ValueError):
+        decoder.close()
+    assert JSONStreamDecoder(ndjson=True).close() == []
+
+
+
+@pytest.mark.parametrize('size', [1, 10, 100000])
+def test_decompressor_multi_member_gzip(size):
+    parts = [json.dumps([dict(part=p, i=i) for i in range(100)]).encode() for p in range(3)]
+    body = b''.join(gzip.compress(part) for part in parts)
+    decompressor = StreamDecompressor('gzip')
+    data = b''.join(decompressor.decompress(body[i:i+size]) for i in range(0, len(body), size))
+    assert data + decompressor.flush() == b''.join(parts)
+
+
+def test_decompressor_raw_deflate():
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    body = compressor.compress(b'[1,2,3]') + compressor.flush()
+    decompressor = StreamDecompressor('deflate')
+    assert decompressor.decompress(body) + decompressor.flush() == b'[1,2,3]'
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_get_set(server, compress):
+    client = AAPSClient(server.url, token=local_token, compress=compress)
+    try:
+        assert client.get_set('measurements') == expected_records('measurements', 500)
+    finally:
+        client.close()
+
+
+def test_get_set_pages_and_since(server):
+    server.paginate = True
+    expected = expected_records('poas', 500)
+    since = expected[199]['modified']
+    pages = []
+    client = AAPSClient(server.url, token=local_token)
+    try:
+        done = client.get_set('poas', since=since, on_page=pages.append, page_size=64)
+    finally:
+        client.close()
+    assert done == 300
+    assert max(len(page) for page in pages) <= 64
+    assert [r for page in pages for r in page] == expected[200:]
+
+
+def test_get_set_errors(server):
+    client = AAPSClient(server.url, token='wrong', retries=0)
+    try:
+        assert client.get_set('epsas') == {'detail': 'Token inválido.'}
+        client.token = local_token
+        with pytest.raises(HTTPError):
+            client.get_set('unknown')
+    finally:
+        client.close()
+
+
+def test_retries_dropped_connections(server):
+    server.failure_rate = 0.5
+    client = AAPSClient(server.url, token=local_token, retries=10, backoff_factor=0)
+    try:
+        assert client.get_set('indicators') == expected_records('indicators', 500)
+    finally:
+        client.close()
+
+
+def test_spool_resumes_with_range(server, tmp_path):
+    server.failure_rate = 1
+    client = AAPSClient(server.url, token=local_token, retries=0, spool_path=str(tmp_path))
+    try:
+        with pytest.raises(ConnectionError):
+            client.get_set('reports')
+    finally:
+        client.close()
+    spooled = (tmp_path / 'reports.part').stat().st_size
+    assert spooled > 0
+
+    server.failure_rate = 0
+    client = AAPSClient(server.url, token=local_token, retries=0, spool_path=str(tmp_path))
+    try:
+        assert client.get_set('reports') == expected_records('reports', 500)
+    finally:
+        client.close()
+    full = len(server.gzip_body(('reports', 0, None), server.get_dataset('reports').body))
+    assert client.bytes_received == full - spooled
+    assert list(tmp_path.iterdir()) == []
+
+
+class EmptyBodyHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def test_get_set_empty_body_is_an_error():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), EmptyBodyHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client = AAPSClient('http://%s:%s' % httpd.server_address[:2], token=local_token, retries=0)
+    try:
+        with pytest.raises(ValueError):
+            client.get_set('epsas', on_page=lambda records: None)
+    finally:
+        client.close()
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_spool_checkpoints_metadata(server, tmp_path, monkeypatch):
+    saves = []
+    save_meta = PartialDownload.save_meta
+    monkeypatch.setattr(PartialDownload, 'save_meta', lambda self: saves.append(self.meta['bytes']) or save_meta(self))
+    monkeypatch.setattr(api, 'spool_checkpoint_bytes', 64 * 1024)
+    server.compress = False
+    server.failure_rate = 1
+    client = AAPSClient(server.url, token=local_token, retries=0, spool_path=str(tmp_path))
+    try:
+        with pytest.raises(ConnectionError):
+            client.get_set('measurements')
+    finally:
+        client.close()
+    spooled = (tmp_path / 'measurements.part').stat().st_size
+    assert 1 < len(saves) <= spooled // (64 * 1024) + 2
+    assert saves[-1] == spooled
+
+
+def test_spool_drops_bytes_after_last_checkpoint(server, tmp_path):
+    server.failure_rate = 1
+    client = AAPSClient(server.url, token=local_token, retries=0, spool_path=str(tmp_path))
+    try:
+        with pytest.raises(ConnectionError):
+            client.get_set('reports')
+    finally:
+        client.close()
+    with open(tmp_path / 'reports.part', 'ab') as f:
+        f.write(b'not yet checkpointed')
+
+    server.failure_rate = 0
+    client = AAPSClient(server.url, token=local_token, retries=0, spool_path=str(tmp_path))
+    try:
+        assert client.get_set('reports') == expected_records('reports', 500)
+    finally:
+        client.close()
+
+
+def closed_port_url():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), EmptyBodyHandler)
+    url = 'http://%s:%s' % httpd.server_address[:2]
+    httpd.server_close()
+    return url
+
+
+def test_get_token_and_is_online(server):
+    client = AAPSClient(server.url, backoff_factor=0)
+    try:
+        assert client.get_token('usuario', 'clave') == {'token': local_token}
+        assert 'non_field_errors' in client.get_token('usuario', '')
+        assert client.is_online(server.url)
+    finally:
+        client.close()
+
+    client = AAPSClient(closed_port_url(), retries=2, backoff_factor=0)
+    try:
+        with pytest.raises(ConnectionError):
+            client.get_token('usuario', 'clave')
+        assert not client.is_online(client.base_url)
+    finally:
+        client.close()
+
+
+def test_timeouts_are_retried_then_raised(server):
+    server.latency = 0.5
+    client = AAPSClient(server.url, token=local_token, retries=1, backoff_factor=0, timeout=(1, 0.05))
+    try:
+        with pytest.raises(ConnectionError):
+            client.get_set('epsas')
+    finally:
+        client.close()
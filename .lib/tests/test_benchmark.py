@@ -0,0 +1,12 @@
+import pytest
+
+from tools.benchmark import run_sync
+
+
+@pytest.mark.parametrize('set_key', ['poas', 'measurements'])
+def test_run_sync_times_every_stage(server, set_key):
+    result = run_sync(server.url, set_key, page_size=100, spool=True, merge=True)
+    assert result['error'] is None
+    assert result['rows'] == 500
+    assert set(result['stages']) == {'download', 'merge', 'write'}
+    assert result['bytes'] > 0
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from tools.schema import compact, to_float, to_float64, format_memory_report
+
+
+def test_compact_dtypes():
+    df = pd.DataFrame(dict(
+        epsa=['EPSA001', 'EPSA002'] * 50,
+        year=np.arange(100, dtype='float64') + 2000,
+        ind1=np.linspace(0, 100, 100).round(2),
+        v1=[1e9 + 0.01 * i for i in range(100)],
+        name=[f'Empresa {i}' for i in range(100)],
+    ))
+    out = compact(df)
+    assert isinstance(out.epsa.dtype, pd.CategoricalDtype)
+    assert out.year.dtype == np.int16
+    assert out.ind1.dtype == np.float32
+    assert out.v1.dtype == np.float64
+    assert out.name.dtype == df.name.dtype
+    assert to_float64(out.ind1).tolist() == df.ind1.tolist()
+    assert compact(out) is out
+
+
+def test_compact_counts_coerced_values():
+    df = pd.DataFrame(dict(ind1=[1.5, 's/d', None, '2.25'], v2=['x', 'y', 3, 4], ind3=[1.0, 2.0, 3.0, 4.0]))
+    coerced = {}
+    out = compact(df, coerced)
+    assert coerced == {'ind1': 1, 'v2': 2}
+    assert out.ind1.isna().tolist() == [False, True, True, False]
+    assert to_float(pd.Series(['a', 1.0]))[1] == 1
+
+    line, = format_memory_report([('Indicadores (datos)', 2e6, 1e6, coerced)])
+    assert line == 'Indicadores (datos): 2.0 MB → 1.0 MB (-50%), 3 valores no numéricos descartados (ind1, v2)'
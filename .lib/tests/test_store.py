@@ -0,0 +1,155 @@
+import os, sqlite3
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from tools.schema import compact
+from tools.store import DataStore, SQLiteStore, KeyIndex, snapshot_id_format, stale_snapshot_age
+
+
+def frame(n, offset=0):
+    return pd.DataFrame(dict(
+        epsa=[f'EPSA{i % 7:03d}' for i in range(n)],
+        year=[2000 + i // 7 for i in range(n)],
+        value=[float(i + offset) for i in range(n)],
+    ))
+
+
+def test_commit_and_rollback(tmp_path):
+    store = DataStore(str(tmp_path), keep=5)
+    store.write('measurements', frame(10))
+    with store.transaction() as snapshot:
+        snapshot.write('measurements', frame(10, offset=100))
+        snapshot.write('reports', frame(3))
+
+    assert store.read('measurements').value.min() == 100
+    assert store.exists('measurements', 'reports')
+    assert store.rollback()
+    assert store.read('measurements').value.min() == 0
+    assert not store.exists('reports')
+
+
+def test_failed_transaction_keeps_current_snapshot(tmp_path):
+    store = DataStore(str(tmp_path), keep=5)
+    store.write('measurements', frame(10))
+    snapshots = store.snapshots()
+    with pytest.raises(RuntimeError):
+        with store.transaction() as snapshot:
+            snapshot.write('measurements', frame(10, offset=100))
+            raise RuntimeError
+    assert store.snapshots() == snapshots
+    assert sorted(os.listdir(store.snapshots_path)) == snapshots
+    assert store.read('measurements').value.min() == 0
+
+
+def test_unchanged_datasets_carry_over(tmp_path):
+    store = DataStore(str(tmp_path), keep=5)
+    store.write('epsas', frame(5))
+    store.write('measurements', frame(10))
+    pd.testing.assert_frame_equal(store.read('epsas'), frame(5))
+
+
+def test_prune(tmp_path):
+    store = DataStore(str(tmp_path), keep=2)
+    os.makedirs(store.snapshots_path)
+    old = (datetime.now() - 2 * stale_snapshot_age).strftime(snapshot_id_format)
+    fresh = datetime.now().strftime(snapshot_id_format)
+    stale_dir = os.path.join(store.snapshots_path, f'{old}-dead')
+    fresh_dir = os.path.join(store.snapshots_path, f'{fresh}-writing')
+    os.makedirs(stale_dir)
+    os.makedirs(fresh_dir)
+
+    for i in range(4):
+        store.write('measurements', frame(10, offset=i))
+
+    assert len(store.snapshots()) == 2
+    assert store.load_manifest()['snapshot'] in store.snapshots()
+    assert not os.path.exists(stale_dir)
+    assert os.path.exists(fresh_dir)
+    assert store.read('measurements').value.min() == 3
+
+
+def test_sqlite_key_index_matches_key_index(tmp_path):
+    df = frame(100)
+    store = SQLiteStore(str(tmp_path / 'aaps.sqlite'))
+    store.write('measurements', df)
+    index = KeyIndex(df, ['epsa', 'year'])
+    sqlite_index = store.key_index('measurements', ['epsa', 'year'])
+
+    assert list(sqlite_index.options()) == list(index.options())
+    assert list(sqlite_index.options('EPSA003')) == list(index.options('EPSA003'))
+    for key in [('EPSA003',), ('EPSA003', 2004), ('EPSA003', slice(2002, 2005))]:
+        expected = index.get(*key, columns=['value']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(sqlite_index.get(*key, columns=['value']).reset_index(drop=True), expected, check_dtype=False)
+    for key_index in [index, sqlite_index]:
+        with pytest.raises(KeyError):
+            key_index.get('EPSA003', columns=['missing'])
+
+
+def test_sqlite_lookups_keep_table_dtypes(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'aaps.sqlite'), schema=compact)
+    store.write('measurements', frame(700))
+    index = store.key_index('measurements', ['epsa', 'year'])
+    table = store.read('measurements')
+
+    one, many = index.get('EPSA003', 2004), index.get('EPSA003')
+    assert len(one) == 1 and len(many) == 100
+    for df in [one, many]:
+        assert df.dtypes.to_dict() == table.dtypes.to_dict()
+    assert isinstance(one['epsa'].dtype, pd.CategoricalDtype)
+
+
+def test_sqlite_options_cached_per_file_version(tmp_path, monkeypatch):
+    store = SQLiteStore(str(tmp_path / 'aaps.sqlite'))
+    store.write('measurements', frame(14))
+    queries = []
+    select = store.select
+    monkeypatch.setattr(store, 'select', lambda sql, params=(): queries.append(sql) or select(sql, params))
+
+    for _ in range(3):
+        assert store.exists('measurements')
+        index = store.key_index('measurements', ['epsa', 'year'])
+        assert index.options('EPSA003') == [2000, 2001]
+    assert len(queries) == 1
+
+    store.write('measurements', frame(21))
+    assert store.key_index('measurements', ['epsa', 'year']).options('EPSA003') == [2000, 2001, 2002]
+    assert len(queries) == 2
+
+
+def test_sqlite_transaction_swaps_tables_together(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'aaps.sqlite'))
+    store.write('poas', frame(10))
+    store.write('poa_totals', frame(10))
+
+    with pytest.raises(RuntimeError):
+        with store.transaction() as transaction:
+            transaction.write('poas', frame(20, offset=100))
+            raise RuntimeError
+    assert len(store.read('poas')) == 10
+
+    with store.transaction() as transaction:
+        transaction.write('poas', frame(20, offset=100))
+        transaction.write('poa_totals', frame(20, offset=100))
+        assert len(store.read('poas')) == 10
+    for name in ['poas', 'poa_totals']:
+        assert store.read(name).value.min() == 100
+    with sqlite3.connect(store.path) as con:
+        names = {row[0] for row in con.execute("SELECT name FROM sqlite_master")}
+    assert names == {'poas', 'poa_totals', 'ix_poas_epsa_year', 'ix_poa_totals_epsa_year'}
+
+
+def test_sqlite_swap_rolls_back_on_error(tmp_path, monkeypatch):
+    store = SQLiteStore(str(tmp_path / 'aaps.sqlite'))
+    store.write('poas', frame(10))
+    store.write('poa_totals', frame(10))
+    monkeypatch.setattr(SQLiteStore, 'index_cols', [['epsa', 'year'], ['bad"col']])
+
+    with pytest.raises(sqlite3.Error):
+        with store.transaction() as transaction:
+            transaction.write('poas', frame(20, offset=100))
+            transaction.write('poa_totals', frame(20, offset=100).assign(**{'bad"col': 1}))
+    for name in ['poas', 'poa_totals']:
+        assert store.read(name).value.min() == 0
+    assert not store.exists('poas__new') and not store.exists('poa_totals__new')
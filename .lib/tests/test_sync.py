@@ -0,0 +1,191 @@
+import random, tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.api import AAPSClient
+from tools.local_api import local_token, make_record
+from tools.schema import compact
+from tools.store import DataStore
+from tools.sync import (
+    poa_cols, poa_key_cols, coop_expenses_cols, muni_expenses_cols, poa_total_groups, poa_totals_cols,
+    get_high_water_mark, merge_by_key, flatten_poas, download_set, build_poa_totals, update_poa_totals, write_dataset,
+)
+
+
+def poa_records(rows):
+    rnd = random.Random(0)
+    return [make_record('poas', i, rnd) for i in range(rows)]
+
+
+def test_high_water_mark():
+    records = [dict(modified='2019-01-02T00:00:00'), dict(modified=None), dict(modified='2019-01-03T00:00:00')]
+    assert get_high_water_mark(records) == '2019-01-03T00:00:00'
+    assert get_high_water_mark(records, '2019-02-01T00:00:00') == '2019-02-01T00:00:00'
+    assert get_high_water_mark([], None) is None
+
+
+def test_merge_by_key_replaces_changed_rows():
+    old_df = pd.DataFrame(dict(epsa=['A', 'A', 'B'], year=[2019, 2020, 2020], value=[1.0, 2.0, 3.0]))
+    new_df = pd.DataFrame(dict(epsa=['A', 'C'], year=[2020, 2020], value=[20.0, 4.0]))
+    df = merge_by_key(old_df, new_df, ['epsa', 'year'])
+    assert df.values.tolist() == [['A', 2019, 1.0], ['A', 2020, 20.0], ['B', 2020, 3.0], ['C', 2020, 4.0]]
+    assert merge_by_key(old_df, new_df.iloc[:0], ['epsa', 'year']) is old_df
+    with pytest.raises(KeyError):
+        merge_by_key(old_df, new_df.drop(columns='year'), ['epsa', 'year'])
+
+
+def test_flatten_poas():
+    records = poa_records(4)
+    df = flatten_poas(records)
+    assert list(df.columns) == poa_cols
+    assert list(df.type) == ['coop', 'muni', 'coop', 'muni']
+    assert df.loc[0, 'costos_operacion'] == records[0]['coop_expense']['costos_operacion']
+    assert df.loc[1, 'gastos_otros'] == records[1]['muni_expense']['gastos_otros']
+    assert df.loc[0, muni_expenses_cols].isna().all()
+    assert df.loc[1, coop_expenses_cols].isna().all()
+
+
+@pytest.mark.parametrize('missing, edits', [
+    (None, [('in_op_ap', 10.0)]),
+    (None, [('costos_operacion', 0.0), ('in_financieros', 5.5)]),
+    (None, [('inv_equipo', 1e6), ('inv_equipo', 3.0)]),
+    ('gastos_otros', [('gastos_otros', 7.0)]),
+])
+def test_update_poa_totals_matches_rebuild(missing, edits):
+    df = flatten_poas(poa_records(4))
+    if missing:
+        df[missing] = np.nan
+    for row in [0, 1]:
+        edited = df.iloc[[row]].copy()
+        totals = build_poa_totals(edited).iloc[0].to_dict()
+        values = edited.iloc[0].to_dict()
+        for col, value in edits:
+            update_poa_totals(totals, values, col, value)
+            edited[col] = value
+        expected = build_poa_totals(edited).iloc[0]
+        for col, value in expected.items():
+            if col not in poa_key_cols:
+                assert totals[col] == pytest.approx(value, nan_ok=True), col
+
+
+def test_group_shares_are_sums_of_item_shares():
+    df = flatten_poas(poa_records(4))
+    df.loc[0, ['in_op_alc_pozo', 'in_op_otros']] = 10.0
+    df.loc[0, ['in_op_ap', 'in_op_alc', 'in_financieros', 'in_no_op_otros']] = [30.0, 20.0, 20.0, 10.0]
+    row = build_poa_totals(df).iloc[0]
+    assert row['share_in_op_otros'] == pytest.approx(20.0)
+    assert row['share_item_in_op_otros'] == pytest.approx(10.0)
+
+    totals = build_poa_totals(df.iloc[[1]]).iloc[0].to_dict()
+    values = df.iloc[1].to_dict()
+    update_poa_totals(totals, values, 'in_op_otros', 1234.5)
+    for label, _, cols in poa_total_groups:
+        for shares in [build_poa_totals(df), pd.DataFrame([totals])]:
+            item_shares = shares[[f'share_item_{c}' for c in cols]].sum(axis=1)
+            np.testing.assert_allclose(shares[f'share_{label}'], item_shares, rtol=1e-9, err_msg=label)
+
+
+def test_download_set_pages_since_and_merge(server):
+    server.paginate = True
+    client = AAPSClient(server.url, token=local_token)
+    try:
+        response = download_set(client, 'poas', page_size=64)
+        records = poa_records(500)
+        assert response['hwm'] == records[-1]['modified']
+        assert response['memory'][1] < response['memory'][0]
+        assert response['memory'][2] == {}
+
+        delta = download_set(client, 'poas', since=records[399]['modified'], page_size=64)
+    finally:
+        client.close()
+
+    assert len(delta['df']) == 100
+    assert delta['hwm'] == response['hwm']
+    df = merge_by_key(response['df'], delta['df'], poa_key_cols)
+    assert len(df) == 500
+
+
+def test_write_dataset_stores_poa_totals(server, tmp_path):
+    client = AAPSClient(server.url, token=local_token)
+    store = DataStore(str(tmp_path), schema=compact)
+    try:
+        response = download_set(client, 'poas')
+    finally:
+        client.close()
+    with store.transaction() as snapshot:
+        write_dataset(snapshot, 'poas', response['df'])
+
+    assert store.columns('poa_totals') == poa_totals_cols
+    totals = store.read('poa_totals')
+    expected = build_poa_totals(flatten_poas(poa_records(500)))
+    assert len(totals) == len(expected)
+    assert totals.epsa.tolist() == expected.epsa.tolist()
+    sums = ['total_in_total', 'total_out_total', 'total_inversiones']
+    np.testing.assert_allclose(totals[sums].sum().values, expected[sums].sum().values, rtol=1e-5)
+
+
+def test_download_set_returns_error_response(server):
+    client = AAPSClient(server.url, token='wrong')
+    try:
+        assert download_set(client, 'epsas') == {'detail': 'Token inválido.'}
+    finally:
+        client.close()
+
+
+class DocumentClient:
+    def __init__(self, document):
+        self.document = document
+
+    def get_set(self, set_key, **kwargs):
+        return self.document
+
+
+def test_download_set_rejects_non_record_documents():
+    assert 'df' not in download_set(DocumentClient(None), 'epsas')
+    assert 'df' not in download_set(DocumentClient('ok'), 'epsas')
+    assert len(download_set(DocumentClient(0), 'epsas')['df']) == 0
+
+
+class PagesClient:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get_set(self, set_key, on_page=None, **kwargs):
+        for page in self.pages:
+            on_page(page)
+        return sum(len(page) for page in self.pages)
+
+
+def test_download_set_spills_compact_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    rnd = random.Random(0)
+    records = [make_record('measurements', i, rnd) for i in range(300)]
+    records[5]['ind1'] = 's/d'
+    records[250]['ind1'] = 'n/a'
+    records[260]['ind2'] = 'x'
+    pages = [records[i:i+100] for i in range(0, 300, 100)]
+
+    response = download_set(PagesClient(pages), 'measurements')
+    df = response['df']
+    assert len(df) == 300
+    assert response['memory'][2] == {'ind1': 2, 'ind2': 1}
+    assert df.ind1.isna().sum() == 2
+    assert df.ind3.dtype == np.float32
+    assert df.ind3.tolist() == pytest.approx([r['ind3'] for r in records], abs=0.005)
+    assert response['memory'][1] < response['memory'][0]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_download_set_cleans_up_on_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+
+    class FailingClient(PagesClient):
+        def get_set(self, set_key, on_page=None, **kwargs):
+            super().get_set(set_key, on_page=on_page)
+            raise ConnectionError
+
+    with pytest.raises(ConnectionError):
+        download_set(FailingClient([poa_records(10)]), 'poas')
+    assert list(tmp_path.iterdir()) == []
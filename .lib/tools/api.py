@@ -0,0 +1,465 @@
+import os, json, codecs, time, hashlib, zlib
+from os.path import exists, getsize, join
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ChunkedEncodingError, Timeout, HTTPError
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+download_chunk_size = 64 * 1024
+default_page_size = 5000
+spool_checkpoint_bytes = 4 * 1024**2
+retry_statuses = [500,502,503,504]
+
+class JSONStreamDecoder:
+    """Incrementally decodes the records of a top-level JSON array (or NDJSON lines) from byte chunks."""
+
+    def __init__(self, ndjson=False):
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.parts = []
+        self.ndjson = ndjson
+        self.is_array = True if ndjson else None
+        self.done = False
+
+    def feed(self, chunk, final=False):
+        text = self.text_decoder.decode(chunk, final=final)
+        if self.is_array is False:
+            self.parts.append(text)
+            return []
+
+        self.buffer += text
+        if self.is_array is None:
+            stripped = self.buffer.lstrip()
+            if not stripped:
+                self.buffer = ''
+                return []
+            self.is_array = stripped[0] == '['
+            if not self.is_array:
+                self.parts.append(self.buffer)
+                self.buffer = ''
+                return []
+            self.buffer = stripped[1:]
+
+        records = []
+        pos = 0
+        length = len(self.buffer)
+        while not self.done:
+            while pos < length and self.buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == length:
+                break
+            if self.buffer[pos] == ']':
+                self.done = True
+                pos += 1
+                break
+            try:
+                record, end = self.json_decoder.raw_decode(self.buffer, pos)
+            except ValueError:
+                break
+            if end == length and not final:
+                break
+            records.append(record)
+            pos = end
+        self.buffer = self.buffer[pos:]
+        return records
+
+    def close(self):
+        records = self.feed(b'', final=True)
+        if self.is_array is None:
+            raise ValueError('Empty JSON document.')
+        if self.is_array and not (self.done or self.ndjson):
+            raise ValueError('Incomplete JSON array.')
+        return records
+
+    @property
+    def document(self):
+        return json.loads(''.join(self.parts)) if self.parts else None
+
+
+class StreamDecompressor:
+    """Incrementally decompresses gzip or deflate encoded byte chunks.
+
+    Concatenated members (multi-member .gz exports) are decompressed one after
+    the other, each with a fresh decompressor started on the previous one's
+    unused_data.
+    """
+
+    def __init__(self, encoding=None):
+        self.encoding = encoding
+        self.wbits = zlib.MAX_WBITS | 32
+        self.obj = zlib.decompressobj(self.wbits) if encoding else None
+        self.first = True
+
+    def decompress(self, chunk):
+        if not self.obj:
+            return chunk
+        if self.obj.eof and chunk:
+            self.obj = zlib.decompressobj(self.wbits)
+        try:
+            data = self.obj.decompress(chunk)
+        except zlib.error:
+            if not (self.first and self.encoding == 'deflate'):
+                raise
+            self.wbits = -zlib.MAX_WBITS
+            self.obj = zlib.decompressobj(self.wbits)
+            data = self.obj.decompress(chunk)
+        self.first = False
+        while self.obj.eof and self.obj.unused_data:
+            rest = self.obj.unused_data
+            self.obj = zlib.decompressobj(self.wbits)
+            data += self.obj.decompress(rest)
+        return data
+
+    def flush(self):
+        return self.obj.flush() if self.obj else b''
+
+
+def get_stream_format(url, headers):
+    content_encoding = headers.get('Content-Encoding','').lower()
+    content_type = headers.get('Content-Type','').lower()
+    path = urlparse(url).path.lower()
+
+    encoding = content_encoding if content_encoding in ['gzip','deflate'] else None
+    if not encoding and ('gzip' in content_type or path.endswith('.gz')):
+        encoding = 'gzip'
+    ndjson = 'ndjson' in content_type or 'jsonlines' in content_type or path.endswith(('.ndjson','.ndjson.gz','.jsonl','.jsonl.gz'))
+    return encoding, ndjson
+
+
+def iter_raw(r):
+    try:
+        for chunk in r.raw.stream(download_chunk_size, decode_content=False):
+            yield chunk
+    except ProtocolError as e:
+        raise ChunkedEncodingError(e)
+    except ReadTimeoutError as e:
+        raise ConnectionError(e)
+
+
+def is_page(response):
+    return isinstance(response, dict) and isinstance(response.get('results'), list)
+
+
+class RecordBatcher:
+    """Groups decoded records into batches, skipping records already delivered before a retry."""
+
+    def __init__(self, on_batch, batch_size):
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.delivered = 0
+        self.seen = 0
+        self.batch = []
+
+    def restart(self):
+        self.seen = 0
+        self.batch = []
+
+    def add(self, records):
+        for record in records:
+            self.seen += 1
+            if self.seen > self.delivered + len(self.batch):
+                self.batch.append(record)
+        while len(self.batch) >= self.batch_size:
+            self.flush(self.batch_size)
+
+    def flush(self, size=None):
+        batch, self.batch = self.batch[:size], self.batch[len(self.batch[:size]):]
+        if batch:
+            self.on_batch(batch)
+            self.delivered += len(batch)
+
+
+class PartialDownload:
+    """On-disk spool of a partially received response, resumable with HTTP Range requests.
+
+    The metadata sidecar is checkpointed every spool_checkpoint_bytes and on close; bytes written
+    after the last checkpoint are cut off by load() and fetched again.
+    """
+
+    def __init__(self, path, url):
+        self.path = path
+        self.meta_path = path + '.json'
+        self.url = url
+        self.meta = dict(url=url, bytes=0, sha256=None, total=None, validator=None)
+        self.hasher = hashlib.sha256()
+        self.file = None
+        self.checkpointed = 0
+
+    def load(self):
+        if not (exists(self.path) and exists(self.meta_path)):
+            self.discard()
+            return 0
+        try:
+            with open(self.meta_path,'r') as f:
+                meta = json.load(f)
+        except ValueError:
+            self.discard()
+            return 0
+        size = getsize(self.path)
+        if meta.get('url') != self.url or not isinstance(meta.get('bytes'), int) or size < meta['bytes']:
+            self.discard()
+            return 0
+        if size > meta['bytes']:
+            os.truncate(self.path, meta['bytes'])
+
+        hasher = hashlib.sha256()
+        for chunk in self.replay():
+            hasher.update(chunk)
+        if hasher.hexdigest() != meta.get('sha256'):
+            self.discard()
+            return 0
+
+        self.meta = meta
+        self.hasher = hasher
+        self.checkpointed = meta['bytes']
+        return meta['bytes']
+
+    def range_headers(self):
+        if not self.meta['bytes']:
+            return {}
+        headers = {'Range': f'bytes={self.meta["bytes"]}-'}
+        if self.meta.get('validator'):
+            headers['If-Range'] = self.meta['validator']
+        return headers
+
+    def start(self, r):
+        offset = self.meta['bytes']
+        if r.status_code == 206 and offset:
+            content_range = r.headers.get('Content-Range','')
+            first, _, total = content_range.replace('bytes ','').partition('/')
+            if first.split('-')[0] != str(offset):
+                self.discard()
+                raise ConnectionError('Unexpected Content-Range in resumed download.')
+            self.meta['total'] = int(total) if total.isdigit() else self.meta.get('total')
+            self.file = open(self.path,'ab')
+            return offset, self.meta['total']
+
+        content_length = r.headers.get('Content-length')
+        encoding, ndjson = get_stream_format(r.url, r.headers)
+        self.meta.update(
+            bytes=0,
+            sha256=None,
+            total=int(content_length) if content_length else None,
+            validator=r.headers.get('ETag') or r.headers.get('Last-Modified'),
+            encoding=encoding,
+            ndjson=ndjson,
+        )
+        self.hasher = hashlib.sha256()
+        self.checkpointed = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path,'wb')
+        self.save_meta()
+        return 0, self.meta['total']
+
+    def replay(self):
+        with open(self.path,'rb') as f:
+            for chunk in iter(lambda: f.read(download_chunk_size), b''):
+                yield chunk
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.meta['bytes'] += len(chunk)
+        if self.meta['bytes'] - self.checkpointed >= spool_checkpoint_bytes:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.file.flush()
+        self.meta['sha256'] = self.hasher.hexdigest()
+        self.save_meta()
+        self.checkpointed = self.meta['bytes']
+
+    def save_meta(self):
+        with open(self.meta_path,'w') as f:
+            json.dump(self.meta,f)
+
+    def close(self):
+        if self.file:
+            self.checkpoint()
+            self.file.close()
+            self.file = None
+
+    def discard(self):
+        self.close()
+        for path in [self.path, self.meta_path]:
+            if exists(path):
+                os.remove(path)
+
+
+class AAPSClient:
+    """Client for the AAPS-API built around a pooled, keep-alive requests.Session.
+
+    Every call (fetch, get_token, is_online) goes through retry: dropped
+    connections, timeouts and 5xx responses are retried with exponential
+    backoff; any other error status raises HTTPError, except 401 whose JSON
+    detail is returned by fetch.
+    """
+
+    def __init__(self, base_url, token=None, pool_size=10, retries=3, backoff_factor=0.5, timeout=(5,60), spool_path=None, compress=True):
+        self.base_url = base_url
+        self.spool_path = spool_path
+        self.compress = compress
+        self.bytes_received = 0
+        self.token = token
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def headers(self):
+        return dict(Authorization=f'Token {self.token}') if self.token else {}
+
+    def backoff(self, attempt):
+        time.sleep(self.backoff_factor * 2 ** attempt)
+
+    def retry(self, call):
+        for attempt in range(self.retries + 1):
+            try:
+                return call()
+            except (ConnectionError, ChunkedEncodingError, Timeout) as e:
+                if attempt == self.retries:
+                    raise ConnectionError(e)
+                self.backoff(attempt)
+            except HTTPError as e:
+                if e.response.status_code not in retry_statuses or attempt == self.retries:
+                    raise
+                self.backoff(attempt)
+
+    def get_token(self, username, password):
+        def post():
+            r = self.session.post(
+                f'{self.base_url}/api-token-auth/',
+                json={'username':username, 'password':password},
+                timeout=self.timeout,
+            )
+            if r.status_code in retry_statuses:
+                r.raise_for_status()
+            return r.json()
+
+        return self.retry(post)
+
+    def get_set(self, set_key, since=None, on_progress=None, on_page=None, page_size=None):
+        params = {}
+        if since:
+            params['modified__gt'] = since
+        if page_size:
+            params['page_size'] = page_size
+
+        records = []
+        collect = on_page is None
+        if collect:
+            on_page = records.extend
+
+        url = f'{self.base_url}/api/{set_key}/?fields!=id'
+        response = self.fetch(set_key, url, params, on_progress, on_page, page_size)
+
+        if is_page(response):
+            page = response
+            total = page.get('count')
+            done = 0
+            while True:
+                on_page(page['results'])
+                done += len(page['results'])
+                if on_progress:
+                    on_progress(done, total, 'records')
+                if not page.get('next'):
+                    break
+                page = self.fetch(set_key, page['next'], None, None, on_page, page_size)
+                if not is_page(page):
+                    return page
+            response = done
+
+        if isinstance(response, int):
+            return records if collect else response
+        return response
+
+    def fetch(self, set_key, url, params, on_progress, on_records, batch_size=None):
+        spool = None
+        if self.spool_path:
+            spool_url = requests.Request('GET', url, params=params).prepare().url
+            spool = PartialDownload(join(self.spool_path,f'{set_key}.part'), spool_url)
+        batcher = RecordBatcher(on_records, batch_size or default_page_size)
+        return self.retry(lambda: self.stream_records(url, params, on_progress, spool, batcher))
+
+    def stream_records(self, url, params, on_progress=None, spool=None, batcher=None):
+        headers = dict(self.headers)
+        offset = 0
+        if spool:
+            offset = spool.load()
+            headers.update(spool.range_headers())
+        headers['Accept-Encoding'] = 'gzip, deflate' if self.compress else 'identity'
+
+        with self.session.get(url, params=params, headers=headers, stream=True, timeout=self.timeout) as r:
+            if spool and offset and r.status_code == 416:
+                spool.discard()
+                return self.stream_records(url, params, on_progress, spool, batcher)
+            if r.status_code != 401:
+                r.raise_for_status()
+
+            if spool:
+                offset, total = spool.start(r)
+                encoding, ndjson = spool.meta['encoding'], spool.meta['ndjson']
+            else:
+                content_length = r.headers.get('Content-length')
+                total = int(content_length) if content_length else None
+                encoding, ndjson = get_stream_format(r.url, r.headers)
+
+            decompressor = StreamDecompressor(encoding)
+            decoder = JSONStreamDecoder(ndjson)
+            batcher.restart()
+            downloaded = offset
+            decoded = 0
+            try:
+                if offset:
+                    for chunk in spool.replay():
+                        data = decompressor.decompress(chunk)
+                        decoded += len(data)
+                        batcher.add(decoder.feed(data))
+                if on_progress:
+                    on_progress(downloaded, total, 'bytes', decoded)
+                for chunk in iter_raw(r):
+                    if spool:
+                        spool.write(chunk)
+                    downloaded += len(chunk)
+                    self.bytes_received += len(chunk)
+                    data = decompressor.decompress(chunk)
+                    decoded += len(data)
+                    batcher.add(decoder.feed(data))
+                    if on_progress:
+                        on_progress(downloaded, total, 'bytes', decoded)
+            finally:
+                if spool:
+                    spool.close()
+
+            if total is not None and downloaded < total:
+                raise ConnectionError('Incomplete download.')
+            try:
+                data = decompressor.flush()
+                batcher.add(decoder.feed(data))
+                batcher.add(decoder.close())
+            except (ValueError, zlib.error):
+                if spool:
+                    spool.discard()
+                raise
+            batcher.flush()
+
+        if spool:
+            spool.discard()
+        return batcher.seen if decoder.is_array else decoder.document
+
+    def is_online(self, url='http://www.google.com'):
+        try:
+            self.retry(lambda: self.session.head(url, timeout=self.timeout))
+            return True
+        except ConnectionError:
+            return False
+
+    def close(self):
+        self.session.close()
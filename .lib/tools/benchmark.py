@@ -0,0 +1,167 @@
+"""Sync throughput benchmark against the local AAPS-API stand-in.
+
+Run from the .lib folder:
+
+    python -m tools.benchmark --sizes 1000 10000 100000 1000000
+
+Every measurement runs the client in a fresh process so that its peak RSS
+is not inflated by previous runs or by the stand-in server. A measurement
+covers the same steps as the data management app: download and decoding,
+flattening and compaction, the merge with the local copy (--merge seeds the
+store with a first untimed sync) and the snapshot write.
+"""
+import sys, json, time, argparse, tempfile, shutil, subprocess
+from contextlib import contextmanager
+from os.path import dirname, abspath
+
+lib_path = dirname(dirname(abspath(__file__)))
+
+
+def peak_rss():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        return None
+
+
+def run_sync(url, set_key, page_size=None, spool=False, compress=True, merge=False):
+    from .api import AAPSClient
+    from .local_api import local_token
+    from .schema import compact
+    from .store import DataStore
+    from .sync import download_set, merge_by_key, write_dataset, set_key_to_index_cols
+
+    spool_path = tempfile.mkdtemp() if spool else None
+    store_path = tempfile.mkdtemp()
+    client = AAPSClient(url, token=local_token, spool_path=spool_path, compress=compress, backoff_factor=0.1)
+    store = DataStore(store_path, keep=1, schema=compact)
+    stages = {}
+
+    @contextmanager
+    def timed(stage):
+        start = time.perf_counter()
+        yield
+        stages[stage] = time.perf_counter() - start
+
+    try:
+        if merge:
+            seed = download_set(client, set_key, page_size=page_size)
+            if 'df' in seed:
+                with store.transaction() as snapshot:
+                    write_dataset(snapshot, set_key, seed['df'])
+            client.bytes_received = 0
+
+        with timed('download'):
+            response = download_set(client, set_key, page_size=page_size)
+        if 'df' in response:
+            df = response['df']
+            if store.exists(set_key) and set_key in set_key_to_index_cols:
+                with timed('merge'):
+                    df = merge_by_key(store.read(set_key), df, set_key_to_index_cols[set_key])
+            with timed('write'):
+                with store.transaction() as snapshot:
+                    write_dataset(snapshot, set_key, df)
+    finally:
+        client.close()
+        if spool_path:
+            shutil.rmtree(spool_path, ignore_errors=True)
+        shutil.rmtree(store_path, ignore_errors=True)
+
+    return dict(
+        rows=len(df) if 'df' in response else 0,
+        columns=len(df.columns) if 'df' in response else 0,
+        error=None if 'df' in response else response,
+        wall=sum(stages.values()),
+        stages=stages,
+        bytes=client.bytes_received,
+        peak_rss=peak_rss(),
+    )
+
+
+def start_server(rows, set_key, args):
+    cmd = [sys.executable, '-m', 'tools.local_api', '--rows', str(rows), '--warm', set_key]
+    if args.latency:
+        cmd += ['--latency', str(args.latency)]
+    if args.failure_rate:
+        cmd += ['--failure-rate', str(args.failure_rate)]
+    if args.paginate:
+        cmd += ['--paginate']
+    if args.no_compress:
+        cmd += ['--no-compress']
+    proc = subprocess.Popen(cmd, cwd=lib_path, stdout=subprocess.PIPE, universal_newlines=True)
+    url = proc.stdout.readline().strip()
+    if not url:
+        proc.kill()
+        raise RuntimeError('El servidor local no pudo iniciarse.')
+    return proc, url
+
+
+def run_worker(url, args):
+    cmd = [sys.executable, '-m', 'tools.benchmark', '--worker', url, '--set-key', args.set_key, '--page-size', str(args.page_size)]
+    if args.spool:
+        cmd += ['--spool']
+    if args.no_compress:
+        cmd += ['--no-compress']
+    if args.merge:
+        cmd += ['--merge']
+    out = subprocess.check_output(cmd, cwd=lib_path, universal_newlines=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+stage_names = ['download', 'merge', 'write']
+stage_headers = ['descarga s', 'fusión s', 'snapshot s']
+
+
+def format_row(size, result):
+    mb = result['bytes'] / 1e6
+    rss = '{:,.1f}'.format(result['peak_rss'] / 1e6) if result['peak_rss'] else '-'
+    rate = mb / result['wall'] if result['wall'] else 0
+    stages = ' '.join('{:>10.3f}'.format(result['stages'][stage]) if stage in result['stages'] else f'{"-":>10}' for stage in stage_names)
+    return f'{size:>10,} {result["rows"]:>10,} {mb:>12,.2f} {result["wall"]:>10.3f} {stages} {rss:>12} {rate:>10,.2f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de sincronización contra el servidor local AAPS-API.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--set-key', default='measurements')
+    parser.add_argument('--page-size', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--paginate', action='store_true')
+    parser.add_argument('--spool', action='store_true')
+    parser.add_argument('--no-compress', action='store_true')
+    parser.add_argument('--merge', action='store_true', help='fusiona la descarga con una copia local sembrada por una primera sincronización')
+    parser.add_argument('--worker', metavar='URL', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_sync(args.worker, args.set_key, args.page_size, args.spool, not args.no_compress, args.merge)
+        print(json.dumps(result))
+        return
+
+    stages = ' '.join(f'{header:>10}' for header in stage_headers)
+    print(f'{"tamaño":>10} {"registros":>10} {"MB recibidos":>12} {"tiempo s":>10} {stages} {"RSS pico MB":>12} {"MB/s":>10}')
+    for size in args.sizes:
+        proc, url = start_server(size, args.set_key, args)
+        try:
+            for _ in range(args.repeat):
+                result = run_worker(url, args)
+                print(format_row(size, result), flush=True)
+                if result['error']:
+                    print(f'    error: {result["error"]}')
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+import io, json, gzip, random, threading, time, argparse
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+from .sync import income_cols, coop_expenses_cols, muni_expenses_cols, investments_cols, expansion_cols
+
+local_token = 'local-token'
+
+epsa_codes = [f'EPSA{i:03d}' for i in range(200)]
+state_names = ['BENI','LA PAZ','CHUQUISACA','COCHABAMBA','SANTA CRUZ','TARIJA','POTOSI','PANDO','ORURO']
+
+base_modified = datetime(2019,1,1)
+
+
+def epsa_year_order(i, orders=1):
+    epsa = epsa_codes[i % len(epsa_codes)]
+    step = i // len(epsa_codes)
+    return epsa, 2000 + step // orders, step % orders + 1
+
+
+def make_record(set_key, i, rnd):
+    modified = (base_modified + timedelta(seconds=i)).isoformat()
+    if set_key == 'epsas':
+        return dict(
+            code=f'EPSA{i:03d}' if i < len(epsa_codes) else f'EPSA{i}',
+            name=f'Empresa de Agua {i}',
+            state=state_names[i % len(state_names)],
+            category='ABCD'[i % 4],
+            modified=modified,
+        )
+    if set_key == 'indicators':
+        record = dict(ind_id=i+1, name=f'Indicador {i+1}', unit='%', modified=modified)
+        for cat in 'ABCD':
+            record[f'par_min_{cat}'] = round(rnd.uniform(0,50),2)
+            record[f'par_max_{cat}'] = round(rnd.uniform(50,100),2)
+        return record
+    if set_key == 'variables':
+        return dict(var_id=i+1, name=f'Variable {i+1}', unit='N°', modified=modified)
+    if set_key == 'measurements':
+        epsa, year, _ = epsa_year_order(i)
+        record = dict(epsa=epsa, year=year, modified=modified)
+        for ind_id in range(1,33):
+            record[f'ind{ind_id}'] = round(rnd.uniform(0,100),2)
+        return record
+    if set_key == 'reports':
+        epsa, year, _ = epsa_year_order(i)
+        record = dict(epsa=epsa, year=year, modified=modified)
+        for var_id in range(1,31):
+            record[f'v{var_id}'] = round(rnd.uniform(0,10000),2)
+        return record
+    if set_key == 'poas':
+        epsa, year, order = epsa_year_order(i, orders=2)
+        record = dict(epsa=epsa, year=year, order=order, modified=modified)
+        for col in income_cols + investments_cols + expansion_cols:
+            record[col] = round(rnd.uniform(0,100000),2)
+        is_coop = i % 2 == 0
+        expense_cols = coop_expenses_cols if is_coop else muni_expenses_cols
+        expense = {col: round(rnd.uniform(0,100000),2) for col in expense_cols}
+        expense['modified'] = modified
+        record['coop_expense'] = expense if is_coop else None
+        record['muni_expense'] = None if is_coop else expense
+        return record
+    raise KeyError(set_key)
+
+
+class SyntheticDataset:
+    """JSON body of a synthetic dataset with the byte offset of every record, ordered by modified."""
+
+    def __init__(self, set_key, rows, seed=0):
+        rnd = random.Random(seed)
+        buffer = io.BytesIO()
+        self.offsets = array('q')
+        self.modified = []
+        buffer.write(b'[')
+        for i in range(rows):
+            if i:
+                buffer.write(b',')
+            record = make_record(set_key, i, rnd)
+            self.offsets.append(buffer.tell())
+            self.modified.append(record['modified'])
+            buffer.write(json.dumps(record, separators=(',',':')).encode())
+        self.offsets.append(buffer.tell())
+        buffer.write(b']')
+        self.body = buffer.getvalue()
+
+    def __len__(self):
+        return len(self.modified)
+
+    def slice(self, start, stop):
+        stop = min(stop, len(self))
+        if start >= stop:
+            return b'[]'
+        return b'[' + self.body[self.offsets[start]:self.offsets[stop] - (1 if stop < len(self) else 0)] + b']'
+
+    def first_after(self, since):
+        return bisect_right(self.modified, since) if since else 0
+
+
+class LocalAPIServer:
+    """Local stand-in for the AAPS-API token and dataset endpoints, serving synthetic data."""
+
+    def __init__(self, rows=1000, latency=0, failure_rate=0, paginate=False, compress=True, seed=0, host='127.0.0.1', port=0):
+        self.rows = rows if isinstance(rows, dict) else {}
+        self.default_rows = rows if not isinstance(rows, dict) else 1000
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.paginate = paginate
+        self.compress = compress
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.datasets = {}
+        self.compressed = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def get_dataset(self, set_key):
+        with self.lock:
+            if set_key not in self.datasets:
+                n = self.rows.get(set_key, self.default_rows)
+                self.datasets[set_key] = SyntheticDataset(set_key, n, self.seed)
+            return self.datasets[set_key]
+
+    def gzip_body(self, key, body):
+        if key not in self.compressed:
+            self.compressed[key] = gzip.compress(body, compresslevel=5, mtime=0)
+        return self.compressed[key]
+
+    def warm(self, set_keys):
+        for set_key in set_keys:
+            dataset = self.get_dataset(set_key)
+            if self.compress:
+                self.gzip_body((set_key, 0, None), dataset.body)
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, obj):
+                body = json.dumps(obj).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if self.path.rstrip('/') != '/api-token-auth':
+                    return self.send_json(404, {'detail': 'No encontrado.'})
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    credentials = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    credentials = {}
+                if credentials.get('username') and credentials.get('password'):
+                    return self.send_json(200, {'token': local_token})
+                return self.send_json(400, {'non_field_errors': ['No puede iniciar sesión con las credenciales proporcionadas.']})
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+
+                url = urlparse(self.path)
+                parts = [p for p in url.path.split('/') if p]
+                if len(parts) != 2 or parts[0] != 'api':
+                    return self.send_json(404, {'detail': 'No encontrado.'})
+                if self.headers.get('Authorization') != f'Token {local_token}':
+                    return self.send_json(401, {'detail': 'Token inválido.'})
+                try:
+                    dataset = server.get_dataset(parts[1])
+                except KeyError:
+                    return self.send_json(404, {'detail': 'No encontrado.'})
+
+                query = parse_qs(url.query)
+                since = query.get('modified__gt', [None])[0]
+                first = dataset.first_after(since)
+
+                if server.paginate and query.get('page_size'):
+                    page_size = max(int(query['page_size'][0]), 1)
+                    page = max(int(query.get('page', ['1'])[0]), 1)
+                    start = first + (page - 1) * page_size
+                    stop = start + page_size
+                    count = len(dataset) - first
+                    next_url = None
+                    if stop < len(dataset):
+                        next_query = {k: v[0] for k, v in query.items()}
+                        next_query['page'] = page + 1
+                        next_url = f'{server.url}{url.path}?{urlencode(next_query, safe="!")}'
+                    body_key = (parts[1], start, stop)
+                    body = b''.join([
+                        b'{"count":', str(count).encode(),
+                        b',"next":', json.dumps(next_url).encode(),
+                        b',"previous":null,"results":', dataset.slice(start, stop), b'}',
+                    ])
+                elif first:
+                    body_key = (parts[1], first, None)
+                    body = dataset.slice(first, len(dataset))
+                else:
+                    body_key = (parts[1], 0, None)
+                    body = dataset.body
+
+                headers = [('Content-Type', 'application/json'), ('Accept-Ranges', 'bytes')]
+                if server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = server.gzip_body(body_key, body)
+                    headers.append(('Content-Encoding', 'gzip'))
+                etag = f'"{parts[1]}-{len(dataset)}-{server.seed}-{len(body)}"'
+                headers.append(('ETag', etag))
+
+                status = 200
+                range_header = self.headers.get('Range')
+                if range_header and self.headers.get('If-Range', etag) == etag and range_header.startswith('bytes='):
+                    start = int(range_header[6:].split('-')[0])
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(body)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    headers.append(('Content-Range', f'bytes {start}-{len(body)-1}/{len(body)}'))
+                    body = body[start:]
+                    status = 206
+
+                self.send_response(status)
+                for k, v in headers:
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+
+                if server.should_fail():
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local que imita los endpoints del sistema AAPS-API.')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--paginate', action='store_true')
+    parser.add_argument('--no-compress', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--warm', nargs='*', default=[], help='conjuntos generados antes de aceptar conexiones')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    server = LocalAPIServer(
+        rows=args.rows,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        paginate=args.paginate,
+        compress=not args.no_compress,
+        seed=args.seed,
+        host=args.host,
+        port=args.port,
+    )
+    server.warm(args.warm)
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import re
+import numpy as np
+import pandas as pd
+
+category_cols = ['epsa','code','state','category','type','name','unit']
+small_int_cols = ['year','order','ind_id','var_id']
+measurement_col_re = re.compile(r'^(ind|v)\d+$')
+
+max_category_ratio = 0.5
+float32_tolerance = 0.005
+
+
+def memory_usage(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def to_category(s):
+    if isinstance(s.dtype, pd.CategoricalDtype) or len(s) == 0:
+        return s
+    if s.nunique(dropna=True) > max_category_ratio * len(s):
+        return s
+    return s.astype('category')
+
+
+def to_small_int(s):
+    if s.dtype.kind not in 'iuf' or s.isna().any():
+        return s
+    if s.dtype.kind == 'f' and not (s == s.round()).all():
+        return s
+    return pd.to_numeric(s.astype('int64'), downcast='integer')
+
+
+def to_float(s):
+    """Returns s as float32 (or float64 when float32 would lose the 2 decimals) and the number of
+    non-numeric values that had to be replaced by NaN."""
+    if s.dtype == np.float32:
+        return s, 0
+    numeric = pd.to_numeric(s, errors='coerce').astype('float64')
+    coerced = int((numeric.isna() & s.notna()).sum())
+    s32 = numeric.astype('float32')
+    if np.allclose(s32.to_numpy(dtype='float64'), numeric.to_numpy(), rtol=0, atol=float32_tolerance, equal_nan=True):
+        return s32, coerced
+    return numeric, coerced
+
+
+def to_float64(s):
+    """Widens float32 values through their shortest decimal repr, so 74.27 shows as 74.27 and not 74.26999664."""
+    if s.dtype != np.float32:
+        return s
+    return pd.to_numeric(s.astype(str))
+
+
+def compact(df, coerced=None, categories=True):
+    """Returns df with compact dtypes: categoricals for repeated labels, small ints for keys and
+    float32 for the ind*/v* measurement columns whenever that keeps them within 2 decimals.
+
+    Non-numeric measurement values become NaN; when `coerced` is a dict, their count per column is
+    added to it. categories=False leaves labels alone, for parts of a frame that are joined later."""
+    cols = {}
+    for col in df.columns:
+        if col in category_cols:
+            if categories:
+                cols[col] = to_category(df[col])
+        elif col in small_int_cols:
+            cols[col] = to_small_int(df[col])
+        elif measurement_col_re.match(str(col)):
+            cols[col], n = to_float(df[col])
+            if n and coerced is not None:
+                coerced[col] = coerced.get(col, 0) + n
+    if all(cols[col].dtype == df[col].dtype for col in cols):
+        return df
+    return df.assign(**{str(col): s for col, s in cols.items()})
+
+
+def format_memory_report(rows):
+    lines = []
+    for name, before, after, coerced in rows:
+        saved = (1 - after / before) * 100 if before else 0
+        line = f'{name}: {before/1e6:,.1f} MB → {after/1e6:,.1f} MB (-{saved:.0f}%)'
+        if coerced:
+            line += f', {sum(coerced.values()):,} valores no numéricos descartados ({", ".join(sorted(coerced))})'
+        lines.append(line)
+    return lines
+
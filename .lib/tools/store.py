@@ -0,0 +1,579 @@
+import os, json, shutil, sqlite3, hashlib, tempfile, threading
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+from os.path import exists, join, dirname, basename
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = feather = None
+
+snapshot_id_format = '%Y%m%dT%H%M%S%f'
+stale_snapshot_age = timedelta(hours=1)
+
+
+class DatasetCache:
+    """Least recently used cache of loaded datasets, bounded by their memory usage.
+
+    Entries are tagged with the version of the file they were read from and
+    are reloaded when it changes. Cached frames are shared, treat them as read-only.
+    """
+
+    def __init__(self, max_bytes=512*1024**2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, df):
+        size = int(df.memory_usage(deep=True).sum())
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[2]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (version, df, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.entries.popitem(last=False)[1][2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+def file_version(path):
+    if path is None or not exists(path):
+        return None
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def snapshot_created(sid):
+    try:
+        return datetime.strptime(sid.split('-')[0], snapshot_id_format)
+    except ValueError:
+        return None
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_json(path, obj):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def write_frame(df, path):
+    """Writes df to path as Feather, or as pickle when pyarrow can't; returns the path written."""
+    try:
+        if path.endswith('.feather'):
+            feather.write_feather(df, path, compression='uncompressed')
+            return path
+    except (pa.ArrowException if pa else ()):
+        if exists(path):
+            os.remove(path)
+        path = path[:-len('feather')] + 'pkl'
+    df.to_pickle(path)
+    return path
+
+
+class Snapshot:
+    """Datasets written into a new snapshot directory of a DataStore and published together on commit."""
+
+    def __init__(self, store):
+        self.store = store
+        os.makedirs(store.snapshots_path, exist_ok=True)
+        prefix = datetime.now().strftime(snapshot_id_format) + '-'
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=store.snapshots_path)
+        self.id = basename(self.path)
+        self.datasets = {}
+
+    def write(self, name, df):
+        df = df.reset_index(drop=True)
+        df.columns = [str(c) for c in df.columns]
+        ext = 'feather' if feather else 'pkl'
+        path = write_frame(df, join(self.path, f'{name}.{ext}'))
+        self.datasets[name] = dict(
+            file=basename(path),
+            rows=len(df),
+            columns=len(df.columns),
+            bytes=os.path.getsize(path),
+            sha256=file_sha256(path),
+        )
+
+    def commit(self):
+        if not self.datasets:
+            return self.discard()
+
+        manifest = self.store.load_manifest()
+        for name, entry in manifest['datasets'].items():
+            if name in self.datasets:
+                continue
+            src = join(self.store.snapshot_dir(manifest['snapshot']), entry['file'])
+            dst = join(self.path, entry['file'])
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+            self.datasets[name] = entry
+
+        write_json(join(self.path, 'manifest.json'), dict(
+            snapshot=self.id,
+            parent=manifest['snapshot'],
+            created=datetime.now().isoformat(),
+            datasets=self.datasets,
+        ))
+        write_json(self.store.current_path, dict(snapshot=self.id))
+        self.store.prune()
+
+    def discard(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class SQLiteTransaction:
+    """Tables written under temporary names and swapped in together, in one SQLite transaction, on commit."""
+
+    def __init__(self, store):
+        self.store = store
+        self.tables = {}
+
+    def write(self, name, df):
+        df = df.reset_index(drop=True)
+        df.columns = [str(c) for c in df.columns]
+        with closing(self.store.connect()) as con:
+            con.execute(f'DROP TABLE IF EXISTS "{name}__new"')
+            df.to_sql(f'{name}__new', con, index=False)
+        self.tables[name] = list(df.columns)
+
+    def commit(self):
+        if not self.tables:
+            return
+        with closing(self.store.connect()) as con:
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                for name, columns in self.tables.items():
+                    con.execute(f'DROP TABLE IF EXISTS "{name}"')
+                    con.execute(f'ALTER TABLE "{name}__new" RENAME TO "{name}"')
+                    indexed = []
+                    for cols in self.store.index_cols:
+                        if all(c in columns for c in cols) and not any(ix[:len(cols)] == cols for ix in indexed):
+                            index_name = f'ix_{name}_{"_".join(cols)}'
+                            quoted_cols = ','.join(f'"{c}"' for c in cols)
+                            con.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{name}" ({quoted_cols})')
+                            indexed.append(cols)
+                con.execute('COMMIT')
+            except BaseException:
+                con.execute('ROLLBACK')
+                self.discard()
+                raise
+
+    def discard(self):
+        with closing(self.store.connect()) as con:
+            for name in self.tables:
+                con.execute(f'DROP TABLE IF EXISTS "{name}__new"')
+
+
+def key_tree(keys):
+    """Nested dicts of distinct key tuples, one level per key column, in the order given."""
+    tree = {}
+    for values in keys:
+        node = tree
+        for value in values:
+            node = node.setdefault(value, {})
+    return tree
+
+
+class KeyIndex:
+    """Rows of a dataset sorted by key columns, served through MultiIndex point and range lookups."""
+
+    def __init__(self, df, key_cols):
+        self.key_cols = list(key_cols)
+        self.df = df.set_axis(pd.MultiIndex.from_frame(df[self.key_cols])).sort_index()
+        self.tree = None
+
+    def memory_usage(self, deep=False):
+        return self.df.memory_usage(deep=deep)
+
+    def options(self, *key):
+        """Sorted distinct values of the key column following key, from a tree of keys built on first use."""
+        if self.tree is None:
+            self.tree = key_tree(self.df.index.unique().tolist())
+        node = self.tree
+        for value in key:
+            node = node.get(value, {})
+        return list(node)
+
+    def get(self, *key, columns=None):
+        """Rows whose leading key columns match key; an item may be a slice for a range."""
+        try:
+            if any(isinstance(k, slice) for k in key):
+                loc = self.df.index.get_locs(list(key))
+            else:
+                loc = self.df.index.get_loc(key)
+        except KeyError:
+            loc = slice(0, 0)
+        if isinstance(loc, (int, np.integer)):
+            loc = slice(loc, loc + 1)
+        if columns:
+            positions = self.df.columns.get_indexer(columns)
+            if (positions < 0).any():
+                raise KeyError([c for c, i in zip(columns, positions) if i < 0])
+            df = self.df.iloc[loc, positions]
+        else:
+            df = self.df.iloc[loc]
+        return df.reset_index(drop=True)
+
+
+class SQLiteKeyIndex:
+    """KeyIndex counterpart for SQLiteStore: every lookup is a SELECT served by the table's composite
+    index, so only the matching rows are loaded.
+
+    Built once per version of the database file: the key tree and the dtypes the schema gives the
+    whole table are computed on first use, and every lookup result is cast to those dtypes, so a
+    column keeps its dtype whatever the number of rows returned.
+    """
+
+    def __init__(self, store, name, key_cols):
+        self.store = store
+        self.name = name
+        self.key_cols = list(key_cols)
+        self.tree = None
+        self.dtypes = None
+
+    def where(self, key):
+        clauses, params = [], []
+        for col, value in zip(self.key_cols, key):
+            if isinstance(value, slice):
+                if value.start is not None:
+                    clauses.append(f'"{col}" >= ?')
+                    params.append(value.start)
+                if value.stop is not None:
+                    clauses.append(f'"{col}" <= ?')
+                    params.append(value.stop)
+            else:
+                clauses.append(f'"{col}" = ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def options(self, *key):
+        """Sorted distinct values of the key column following key, from a tree of keys built on first use."""
+        if self.tree is None:
+            cols = ','.join(f'"{c}"' for c in self.key_cols)
+            df = self.store.select(f'SELECT DISTINCT {cols} FROM "{self.name}" ORDER BY {cols}')
+            self.tree = key_tree(df.dropna().itertuples(index=False, name=None))
+        node = self.tree
+        for value in key:
+            node = node.get(value, {})
+        return list(node)
+
+    def table_dtypes(self):
+        if self.dtypes is None:
+            self.dtypes = self.store.read(self.name).dtypes.to_dict()
+        return self.dtypes
+
+    def get(self, *key, columns=None):
+        """Rows whose leading key columns match key; an item may be a slice for an inclusive range."""
+        dtypes = self.table_dtypes()
+        if columns:
+            missing = [c for c in columns if c not in dtypes]
+            if missing:
+                raise KeyError(missing)
+        cols = ','.join(f'"{c}"' for c in columns) if columns else '*'
+        order = ','.join(f'"{c}"' for c in self.key_cols)
+        where, params = self.where(key)
+        df = self.store.select(f'SELECT {cols} FROM "{self.name}"{where} ORDER BY {order}', params)
+        return df.astype({c: dtypes[c] for c in df.columns})
+
+
+class MappingRegistry:
+    """CSV mappings of a folder as dicts of rows keyed by code, reloaded when a file changes."""
+
+    def __init__(self, path, key='code'):
+        self.path = path
+        self.key = key
+        self.mappings = {}
+        self.lock = threading.Lock()
+
+    def version(self, name):
+        return file_version(join(self.path, f'{name}.csv'))
+
+    def get(self, name):
+        """Rows of name.csv keyed by code (first row wins), or {} when the file is missing."""
+        version = self.version(name)
+        with self.lock:
+            loaded = self.mappings.get(name)
+            if loaded is None or loaded[0] != version:
+                rows = {}
+                if version is not None:
+                    df = pd.read_csv(join(self.path, f'{name}.csv'), dtype=str, keep_default_na=False)
+                    rows = {row[self.key]: row for row in df.drop_duplicates(self.key).to_dict('records')}
+                loaded = self.mappings[name] = (version, rows)
+            return loaded[1]
+
+
+class Store:
+    def derived(self, name, tag, build):
+        """build(df) of a dataset, computed once per dataset version and cached under tag."""
+        key = ('derived', self.path, name, tag)
+        version = self.version(name)
+        result = self.cache.get(key, version) if self.cache is not None else None
+        if result is None:
+            result = build(self.read(name))
+            if self.cache is not None:
+                self.cache.put(key, version, result)
+        return result
+
+    def key_index(self, name, key_cols):
+        """KeyIndex of a dataset, built once per dataset version."""
+        return self.derived(name, ('index', tuple(key_cols)), lambda df: KeyIndex(df, key_cols))
+
+
+class DataStore(Store):
+    """Local dataset store written as typed columnar files (Feather, or pickle when pyarrow is missing).
+
+    Feather files are written uncompressed and opened memory-mapped, so
+    kernels reading the same dataset share the OS page cache.
+
+    Every write creates a new snapshot directory with a manifest.json (rows,
+    columns, size and sha256 of each file) and then swaps current.json to it,
+    so readers never see a half written dataset. Unchanged files are hard
+    linked from the previous snapshot and the last `keep` snapshots are kept
+    for rollback. `schema`, when given, is applied to every frame read.
+    """
+
+    extensions = ['feather','pkl']
+
+    def __init__(self, path, cache=None, keep=5, schema=None):
+        self.path = path
+        self.cache = cache
+        self.keep = keep
+        self.schema = schema
+        self.snapshots_path = join(path, 'snapshots')
+        self.current_path = join(path, 'current.json')
+
+    def snapshot_dir(self, snapshot):
+        return join(self.snapshots_path, snapshot) if snapshot else self.path
+
+    def read_manifest(self, snapshot):
+        with open(join(self.snapshot_dir(snapshot), 'manifest.json'), 'r') as f:
+            return json.load(f)
+
+    def load_manifest(self):
+        if exists(self.current_path):
+            with open(self.current_path, 'r') as f:
+                return self.read_manifest(json.load(f)['snapshot'])
+
+        # files written before snapshots existed, straight in the store folder
+        datasets = {}
+        if exists(self.path):
+            for fn in sorted(os.listdir(self.path)):
+                name, _, ext = fn.rpartition('.')
+                if ext in self.extensions and name not in datasets:
+                    datasets[name] = dict(file=fn)
+        return dict(snapshot=None, datasets=datasets)
+
+    def snapshots(self):
+        if not exists(self.snapshots_path):
+            return []
+        return sorted(sid for sid in os.listdir(self.snapshots_path) if exists(join(self.snapshots_path, sid, 'manifest.json')))
+
+    def find(self, name):
+        manifest = self.load_manifest()
+        entry = manifest['datasets'].get(name)
+        if entry is None or (entry['file'].endswith('.feather') and not feather):
+            return None
+        path = join(self.snapshot_dir(manifest['snapshot']), entry['file'])
+        return path if exists(path) else None
+
+    def exists(self, *names):
+        return all(self.find(name) for name in names)
+
+    def version(self, name):
+        return file_version(self.find(name))
+
+    def columns(self, name):
+        path = self.find(name)
+        if path is None:
+            raise FileNotFoundError(join(self.path, name))
+        if path.endswith('.feather'):
+            return feather.read_table(path, memory_map=True).column_names
+        return list(self.read(name).columns)
+
+    def read(self, name, columns=None):
+        path = self.find(name)
+        if path is None:
+            raise FileNotFoundError(join(self.path, name))
+        key = (self.path, name, tuple(columns) if columns else None)
+        version = file_version(path)
+        if self.cache is not None:
+            df = self.cache.get(key, version)
+            if df is not None:
+                return df
+
+        if path.endswith('.feather'):
+            table = feather.read_table(path, columns=columns, memory_map=True)
+            df = table.to_pandas(split_blocks=True)
+        else:
+            df = pd.read_pickle(path)
+            df = df[columns] if columns else df
+        if self.schema:
+            df = self.schema(df)
+
+        if self.cache is not None:
+            self.cache.put(key, version, df)
+        return df
+
+    @contextmanager
+    def transaction(self):
+        snapshot = Snapshot(self)
+        try:
+            yield snapshot
+        except BaseException:
+            snapshot.discard()
+            raise
+        snapshot.commit()
+
+    def write(self, name, df):
+        with self.transaction() as snapshot:
+            snapshot.write(name, df)
+
+    def rollback(self):
+        manifest = self.load_manifest()
+        parent = manifest.get('parent')
+        if not parent or parent not in self.snapshots():
+            return False
+        write_json(self.current_path, dict(snapshot=parent))
+        return True
+
+    def prune(self):
+        """Removes every snapshot folder except the current one and the `keep` newest manifests.
+
+        Folders without a manifest (a partly removed snapshot, or the temp dir
+        of a kernel that died before commit) are removed once they are older
+        than stale_snapshot_age, so transactions still being written survive.
+        """
+        current = self.load_manifest()['snapshot']
+        snapshots = self.snapshots()
+        kept = set(snapshots[max(len(snapshots) - self.keep, 0):]) | {current}
+        stale = datetime.now() - stale_snapshot_age
+        for sid in os.listdir(self.snapshots_path) if exists(self.snapshots_path) else []:
+            if sid in kept:
+                continue
+            if sid not in snapshots:
+                created = snapshot_created(sid)
+                if created is None or created > stale:
+                    continue
+            # a kernel may still have a file mapped (Windows); retried on the next prune
+            shutil.rmtree(join(self.snapshots_path, sid), ignore_errors=True)
+
+
+class SQLiteStore(Store):
+    """Dataset store backed by an embedded SQLite database with composite indexes on the lookup keys.
+
+    The tables written in one transaction() are swapped in together by a single SQLite transaction,
+    so readers see either all of them or none. Table names and columns, key indexes and whole
+    table reads are kept per version of the database file; `schema`, when given, is applied to
+    whole table reads only, and lookups take the dtypes it gave the table.
+    """
+
+    index_cols = [['type','epsa','year','order'],['epsa','year','order'],['epsa','year'],['code'],['ind_id'],['var_id']]
+
+    def __init__(self, path, cache=None, schema=None):
+        self.path = path
+        self.cache = cache
+        self.schema = schema
+        self.tables = (None, {})
+        self.key_indexes = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        transaction = SQLiteTransaction(self)
+        try:
+            yield transaction
+        except BaseException:
+            transaction.discard()
+            raise
+        transaction.commit()
+
+    def connect(self):
+        # autocommit mode: the sqlite3 module would otherwise run DDL outside of our BEGIN ... COMMIT
+        os.makedirs(dirname(self.path), exist_ok=True)
+        return sqlite3.connect(self.path, isolation_level=None)
+
+    def table_columns(self):
+        """Columns of every table, read once per version of the database file."""
+        version = file_version(self.path)
+        with self.lock:
+            if self.tables[0] != version:
+                columns = {}
+                if version is not None:
+                    with closing(self.connect()) as con:
+                        for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+                            columns[name] = [row[1] for row in con.execute(f'PRAGMA table_info("{name}")')]
+                self.tables = (version, columns)
+            return self.tables[1]
+
+    def exists(self, *names):
+        tables = self.table_columns()
+        return bool(tables) and all(name in tables for name in names)
+
+    def columns(self, name):
+        return list(self.table_columns().get(name, []))
+
+    def select(self, sql, params=()):
+        with closing(self.connect()) as con:
+            return pd.read_sql_query(sql, con, params=[p.item() if hasattr(p, 'item') else p for p in params])
+
+    def version(self, name):
+        return file_version(self.path) if self.exists(name) else None
+
+    def read(self, name, columns=None):
+        key = (self.path, name, tuple(columns) if columns else None)
+        version = self.version(name)
+        if self.cache is not None:
+            df = self.cache.get(key, version)
+            if df is not None:
+                return df
+        cols = ','.join(f'"{c}"' for c in columns) if columns else '*'
+        df = self.select(f'SELECT {cols} FROM "{name}"')
+        if self.schema:
+            df = self.schema(df)
+        if self.cache is not None:
+            self.cache.put(key, version, df)
+        return df
+
+    def key_index(self, name, key_cols):
+        """SQLiteKeyIndex of a table, built once per version of the database file."""
+        key = (name, tuple(key_cols))
+        version = file_version(self.path)
+        with self.lock:
+            entry = self.key_indexes.get(key)
+            if entry is None or entry[0] != version:
+                entry = self.key_indexes[key] = (version, SQLiteKeyIndex(self, name, key_cols))
+            return entry[1]
+
+    def write(self, name, df):
+        with self.transaction() as transaction:
+            transaction.write(name, df)
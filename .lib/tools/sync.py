@@ -0,0 +1,197 @@
+"""Dataset layout and the download, merge and snapshot steps of a sync, free of any UI code."""
+import shutil, tempfile
+from os.path import join
+import numpy as np
+import pandas as pd
+from .schema import compact, memory_usage
+from .store import write_frame, feather, pa
+
+epsas_cols = ['code','name','state','category']
+
+general_cols = ['epsa','year','order']
+income_cols = ['in_op_ap','in_op_alc','in_op_alc_pozo','in_op_otros','in_financieros','in_no_op_otros']
+coop_expenses_cols = [
+    'costos_operacion',
+    'costos_mantenimiento',
+    'gastos_administrativos',
+    'gastos_comerciales',
+    'gastos_financieros',
+]
+muni_expenses_cols = [
+    'gastos_empleados_permanentes',
+    'gastos_empleados_no_permanentes',
+    'gastos_prevision_social',
+    'gastos_servicio_no_personales',
+    'gastos_materiales',
+    'gastos_activos',
+    'gastos_deuda_publica',
+    'gastos_transferencias',
+    'gastos_impuesto',
+    'gastos_otros',
+]
+investments_cols = [
+    'inv_infraestructura_ap',
+    'inv_infraestructura_alc',
+    'inv_equipo',
+    'inv_diseno_estudio',
+    'inv_otros',
+]
+expansion_cols = [
+    'pob_total','pob_ap','pob_alc','con_ap','con_ap_total',
+    'cob_ap','con_alc','con_alc_total','cob_alc','cob_micro',
+    'anc',
+]
+poa_key_cols = ['type'] + general_cols
+poa_cols = poa_key_cols + income_cols + coop_expenses_cols + muni_expenses_cols + investments_cols + expansion_cols
+
+poa_total_groups = [
+    ('in_op','in_total',['in_op_ap','in_op_alc','in_op_alc_pozo','in_op_otros']),
+    ('in_op_serv','in_total',['in_op_ap','in_op_alc']),
+    ('in_op_otros','in_total',['in_op_alc_pozo','in_op_otros']),
+    ('in_no_op','in_total',['in_financieros','in_no_op_otros']),
+    ('in_total','in_total',income_cols),
+    ('out_total','out_total',coop_expenses_cols + muni_expenses_cols),
+    ('costos','out_total',coop_expenses_cols[:2]),
+    ('gastos','out_total',coop_expenses_cols[2:] + muni_expenses_cols),
+    ('serv_pers','out_total',muni_expenses_cols[:3]),
+    ('inversiones','inversiones',investments_cols),
+]
+poa_share_groups = [
+    ('in_total',income_cols),
+    ('out_total',coop_expenses_cols + muni_expenses_cols),
+    ('inversiones',investments_cols),
+]
+
+set_key_to_index_cols = dict(
+    epsas=['code'],
+    poas=poa_key_cols,
+    indicators=['ind_id'],
+    measurements=['epsa','year'],
+    reports=['epsa','year'],
+)
+
+def get_high_water_mark(records, previous=None):
+    marks = [rec['modified'] for rec in records if isinstance(rec,dict) and rec.get('modified')]
+    if previous:
+        marks.append(previous)
+    return max(marks) if marks else None
+
+def merge_by_key(old_df, new_df, key_cols):
+    if old_df is None or old_df.empty:
+        return new_df
+    if new_df.empty:
+        return old_df
+    missing = [c for c in key_cols if c not in old_df or c not in new_df]
+    if missing:
+        raise KeyError(missing)
+    df = pd.concat([old_df,new_df],sort=False)
+    return df.drop_duplicates(subset=key_cols,keep='last').sort_values(key_cols).reset_index(drop=True)
+
+def flatten_poas(records):
+    df = pd.DataFrame(records,dtype=object)
+    for col in ['coop_expense','muni_expense']:
+        if col not in df:
+            df[col] = None
+
+    is_coop = df.coop_expense.notna()
+    df = df[is_coop | df.muni_expense.notna()]
+    is_coop = is_coop[df.index]
+    expense_df = pd.DataFrame(df.coop_expense.where(is_coop,df.muni_expense).tolist(),columns=coop_expenses_cols+muni_expenses_cols,index=df.index,dtype=object)
+
+    df = df.drop(columns=['coop_expense','muni_expense']+list(expense_df),errors='ignore').join(expense_df)
+    df['type'] = np.where(is_coop,'coop','muni')
+    df = df.reindex(columns=poa_cols).reset_index(drop=True)
+
+    numeric_cols = [c for c in poa_cols if c not in ['type','epsa']]
+    df[numeric_cols] = df[numeric_cols].astype('float64')
+    return df.infer_objects()
+
+def records_to_frame(set_key, records):
+    if set_key == 'epsas':
+        return pd.DataFrame(records,columns=epsas_cols)
+
+    if set_key == 'poas':
+        return flatten_poas(records)
+
+    df = pd.DataFrame(records)
+    if 'modified' in df:
+        del df['modified']
+    return df
+
+def read_pages(paths):
+    if feather and all(path.endswith('.feather') for path in paths):
+        tables = [feather.read_table(path) for path in paths]
+        try:
+            return pa.concat_tables(tables,promote_options='permissive').to_pandas()
+        except (TypeError,pa.ArrowException):
+            pass
+    return pd.concat([pd.read_feather(path) if path.endswith('.feather') else pd.read_pickle(path) for path in paths],ignore_index=True,sort=False)
+
+def download_set(client, set_key, since=None, on_progress=None, page_size=None):
+    # every page is compacted and spilled to its own file as it arrives, so only the final, compact
+    # frame is ever held in memory; merge_by_key, the derived tables and the snapshot write need it whole
+    pages_path = tempfile.mkdtemp(prefix=f'{set_key}-')
+    page_paths = []
+    hwm = [since]
+    memory_before = [0]
+    coerced = {}
+
+    def on_page(records):
+        hwm[0] = get_high_water_mark(records,hwm[0])
+        df = records_to_frame(set_key,records)
+        memory_before[0] += memory_usage(df)
+        ext = 'feather' if feather else 'pkl'
+        page_paths.append(write_frame(compact(df,coerced,categories=False),join(pages_path,f'{len(page_paths):06d}.{ext}')))
+
+    try:
+        response = client.get_set(set_key,since=since,on_progress=on_progress,on_page=on_page,page_size=page_size)
+        if isinstance(response,dict):
+            return response
+        if not isinstance(response,int):
+            # a document that is neither records nor an error detail must not replace the stored set
+            return dict(detail='Respuesta inesperada del servidor.')
+        df = read_pages(page_paths) if page_paths else records_to_frame(set_key,[])
+    finally:
+        shutil.rmtree(pages_path,ignore_errors=True)
+
+    df = compact(df)
+    return dict(df=df,hwm=hwm[0],memory=(memory_before[0],memory_usage(df),coerced))
+
+def build_poa_totals(poas_df):
+    df = poas_df.reindex(columns=poa_cols)
+    totals = pd.DataFrame({f'total_{label}': df[cols].sum(axis=1) for label,_,cols in poa_total_groups},index=df.index)
+    shares = {f'share_{label}': totals[f'total_{label}'] / totals[f'total_{total}'] * 100 for label,total,_ in poa_total_groups}
+    for total,cols in poa_share_groups:
+        shares.update({f'share_item_{c}': df[c] / totals[f'total_{total}'] * 100 for c in cols})
+    return pd.concat([df[poa_key_cols],totals,pd.DataFrame(shares,index=df.index)],axis=1).reset_index(drop=True)
+
+poa_totals_cols = list(build_poa_totals(pd.DataFrame(columns=poa_cols)).columns)
+
+poa_total_group_cols = {label: cols for label,_,cols in poa_total_groups}
+
+def share(value, total):
+    return value / total * 100 if total else float('nan')
+
+def update_poa_totals(totals, values, col, value):
+    delta = value - (0 if pd.isna(values[col]) else values[col])
+    values[col] = value
+    for label,_,cols in poa_total_groups:
+        if col in cols:
+            totals[f'total_{label}'] += delta
+    for total,cols in poa_share_groups:
+        if col in cols:
+            for label,group_total,_ in poa_total_groups:
+                if group_total == total:
+                    totals[f'share_{label}'] = share(totals[f'total_{label}'],totals[f'total_{total}'])
+            for c in cols:
+                if c in values:
+                    totals[f'share_item_{c}'] = share(values[c],totals[f'total_{total}'])
+
+set_key_to_derived = dict(
+    poas=[('poa_totals',build_poa_totals)],
+)
+
+def write_dataset(snapshot, set_key, df):
+    snapshot.write(set_key,df)
+    for name,build in set_key_to_derived.get(set_key,[]):
+        snapshot.write(name,build(df))
@@ -1,15 +1,26 @@
 import zipfile, kml2geojson
-import os, stat, json, requests, base64
-from requests.exceptions import ConnectionError
+import os, re, stat, json, base64, threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import ConnectionError, Timeout, HTTPError
 from os.path import exists, join, dirname, abspath
 import traitlets
 from ipywidgets import widgets
 from tkinter import Tk, filedialog
 import ipyleaflet as leaflet
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import qgrid
 import docx, docxtpl
+from .api import AAPSClient, default_page_size
+from .store import DataStore, SQLiteStore, DatasetCache, KeyIndex, MappingRegistry
+from .schema import compact, to_float64, format_memory_report
+from .sync import (
+    general_cols, income_cols, coop_expenses_cols, muni_expenses_cols, investments_cols, expansion_cols,
+    poa_key_cols, poa_cols, set_key_to_index_cols, poa_total_group_cols, poa_totals_cols,
+    merge_by_key, download_set, build_poa_totals, update_poa_totals, write_dataset,
+)
 
 home_dir = dirname(dirname(dirname(abspath(__file__))))
 
@@ -34,7 +45,11 @@ reports_xl_path = join(data_path,'datos_variables.xlsx')
 indicators_xl_path = join(data_path,'indicadores.xlsx')
 measurements_xl_path = join(data_path,'datos_indicadores.xlsx')
 
-xl_paths = [coop_xl_path,muni_xl_path,epsas_xl_path,variables_xl_path,reports_xl_path,indicators_xl_path,measurements_xl_path]
+store_path = join(data_path,'almacen')
+sqlite_path = join(store_path,'aaps.sqlite')
+
+sync_state_path = join(data_path,'sync_state.json')
+spool_path = join(data_path,'.parcial')
 
 coop_tpl_path = join(tpl_path,'coop_poa_tpl.docx')
 muni_tpl_path = join(tpl_path,'muni_poa_tpl.docx')
@@ -44,6 +59,10 @@ server_base_url = 'http://aaps-lab.ml'
 
 api_set_keys = ['epsas','poas','indicators','measurements','variables','reports']
 
+max_concurrent_downloads = 3
+dataset_cache_bytes = 512*1024**2
+kept_snapshots = 5
+
 set_key_to_verbose = dict(
     epsas = 'EPSAs',
     poas = 'POAs',
@@ -61,6 +80,55 @@ dataset_name_to_keys = dict(
     VARIABLES=['variables','reports'],
 )
 
+set_key_to_xl_path = dict(
+    epsas=epsas_xl_path,
+    indicators=indicators_xl_path,
+    measurements=measurements_xl_path,
+    variables=variables_xl_path,
+    reports=reports_xl_path,
+)
+
+poa_sheet_names = ['general','ingresos','gastos','inversiones','metas expansión']
+poa_sheet_cols = dict(
+    coop=[general_cols,income_cols,coop_expenses_cols,investments_cols,expansion_cols],
+    muni=[general_cols,income_cols,muni_expenses_cols,investments_cols,expansion_cols],
+)
+poa_type_to_xl_path = dict(coop=coop_xl_path,muni=muni_xl_path)
+
+store_backends = [('Archivos columnares','columnar'),('SQLite indexado','sqlite')]
+
+def get_store_backend():
+    if exists(profile_path):
+        with open(profile_path,'r') as f:
+            return json.load(f).get('store_backend','columnar')
+    return 'columnar'
+
+def make_data_store(backend):
+    if backend == 'sqlite':
+        return SQLiteStore(sqlite_path,cache=dataset_cache,schema=compact)
+    return DataStore(store_path,cache=dataset_cache,keep=kept_snapshots,schema=compact)
+
+dataset_cache = DatasetCache(dataset_cache_bytes)
+data_store = make_data_store(get_store_backend())
+
+warming_up_html = '<font color="gray"><i class="fa fa-spinner fa-spin"></i> Preparando datos...</font>'
+data_ready_html = '<font color="green"><i class="fa fa-check"></i> Datos listos</font>'
+
+def start_warm_up(loaders, status_html):
+    def warm_up():
+        status_html.value = warming_up_html
+        try:
+            for load in loaders:
+                load()
+        except Exception:
+            status_html.value = ''
+            return
+        status_html.value = data_ready_html
+
+    thread = threading.Thread(target=warm_up,daemon=True)
+    thread.start()
+    return thread
+
 def rmtree(top):
     for root, dirs, files in os.walk(top, topdown=False):
         for name in files:
@@ -71,10 +139,112 @@ def rmtree(top):
             os.rmdir(os.path.join(root, name))
     os.rmdir(top)
 
+def load_sync_state():
+    if exists(sync_state_path):
+        with open(sync_state_path,'r') as f:
+            return json.load(f)
+    return {}
+
+def save_sync_state(sync_state):
+    with open(sync_state_path,'w') as f:
+        json.dump(sync_state,f)
+
+cat_to_par_min = {cat : f'par_min_{cat}' for cat in ['A','B','C','D',]}
+cat_to_par_max = {cat : f'par_max_{cat}' for cat in ['A','B','C','D',]}
+
+def parameters_to_text(par_min, par_max):
+    min_null, max_null = par_min.isna(), par_max.isna()
+    min_text, max_text = par_min.map(str), par_max.map(str)
+    return pd.Series(np.select(
+        [max_null & ~min_null, min_null & ~max_null, par_min == par_max],
+        ['>= al ' + min_text, '<= al ' + max_text, min_text],
+        'Entre ' + min_text + ' y ' + max_text,
+    ),index=par_min.index)
+
+def build_parameter_texts(indicators_df):
+    df = indicators_df.set_index('ind_id')
+    return pd.DataFrame({cat: parameters_to_text(df[cat_to_par_min[cat]],df[cat_to_par_max[cat]]) for cat in cat_to_par_min})
+
+def build_indicator_matrix(measurements_df):
+    ind_cols = [c for c in measurements_df.columns if re.match(r'^ind\d+$',c)]
+    df = measurements_df.drop_duplicates(['epsa','year'],keep='last').set_index(['epsa','year'])[ind_cols]
+    df.columns = pd.Index([int(c[3:]) for c in ind_cols],name='ind_id')
+    return df.stack().unstack('year').sort_index()
+
+ant_par_2_epsas = [
+    'EPSAS','SAGUAPAC','COSMOL','ELAPAS','SEMAPA',
+    'SELA','COATRI','CAPAG','AAPOS','COSAALT',
+    'EMAPYC','COSPHUL','COSCHAL','COOPAGUAS','COSPAIL',
+    'COOPLAN','EMAAB','LA GUARDIA','COOPAPPI','COSMIN',
+    'EMSABAV','COSPAS','SEAPAS','COSAP','COOPLIM',
+    'MANCHACO','COSEPW',
+]
+
+mapping_registry = MappingRegistry(mappings_path)
+
+@lru_cache(maxsize=512)
+def build_ant_pars(epsa, mapping_versions):
+    ant_pars = []
+    if epsa in ant_par_2_epsas:
+        ant_pars.append(f'Manual de Seguimiento de cumplimiento de obligaciones compromisos y procedimientos a seguir de la EPSA {epsa}.')
+    else:
+        ant_pars.append('Mediante la RAR SISAB Nº 124/2007 del 12 de junio del 2007 se aprueba la guía de solicitud de Licencias y Registros, Manual de Seguimiento de Licencias y Manual para la elaboración del Plan de Desarrollo Quinquenal para licencias.')
+
+    row = mapping_registry.get('anexo_3').get(epsa)
+    if row is not None:
+        ant_pars.append(f'Mediante RAR AAPS Nº {row["number"]}, de fecha XXXX, se otorga la Licencia a "{row["name"]}".')
+
+    row = mapping_registry.get('anexo_4').get(epsa)
+    if row is not None:
+        instructivo_circular = 'del Instructivo' if row['type'] == 'instructivo' else 'de la Circular'
+        ant_pars.append(f'A través {instructivo_circular} AAPS/DER/INS/Nº{row["number"]}, de fecha {row["date"]}, se comunica a la EPSA el Cronograma de Reporte de Información y Obligaciones de Titulares de Licencia.')
+
+    return tuple(ant_pars)
+
+def get_ant_pars(epsa):
+    mapping_versions = tuple(mapping_registry.version(name) for name in ['anexo_3','anexo_4'])
+    return list(build_ant_pars(epsa,mapping_versions))
+
+def format_numbers(values, decimals=2):
+    s = pd.Series(values,dtype='float64')
+    return s.map(f'{{:,.{decimals}f}}'.format).where(s.notna(),'-').tolist()
+
+def export_to_excel(set_key, df):
+    df = df.apply(to_float64)
+    if set_key == 'poas':
+        for poa_type,xl_path in poa_type_to_xl_path.items():
+            tdf = df[df.type==poa_type]
+            with pd.ExcelWriter(xl_path) as writer:
+                for cols_list,sn in zip(poa_sheet_cols[poa_type],poa_sheet_names):
+                    tdf[cols_list].to_excel(writer,sheet_name=sn,index=False)
+    else:
+        df.to_excel(set_key_to_xl_path[set_key])
+
+excel_import_lock = threading.Lock()
+
+def has_excel_cache():
+    if any(exists(xl_path) and not data_store.exists(set_key) for set_key,xl_path in set_key_to_xl_path.items()):
+        return True
+    return not data_store.exists('poas') and any(exists(xl_path) for xl_path in poa_type_to_xl_path.values())
+
+def import_excel_cache():
+    with excel_import_lock:
+        for set_key,xl_path in set_key_to_xl_path.items():
+            if exists(xl_path) and not data_store.exists(set_key):
+                data_store.write(set_key,pd.read_excel(xl_path,index_col=0))
+
+        if not data_store.exists('poas'):
+            frames = []
+            for poa_type,xl_path in poa_type_to_xl_path.items():
+                if exists(xl_path):
+                    df = pd.concat([pd.read_excel(xl_path,sheet_name=sn) for sn in poa_sheet_names],axis=1)
+                    frames.append(df.assign(type=poa_type))
+            if frames:
+                with data_store.transaction() as snapshot:
+                    write_dataset(snapshot,'poas',pd.concat(frames,sort=False).reindex(columns=poa_cols))
+
 class GenerateReportWidget(widgets.VBox):
     def __init__(self, **kwargs):
-        def text_to_float(x):
-            return float(x.replace(',',''))
         def float_to_text(x):
             return "{:,.2f}".format(x)
 
@@ -131,15 +301,6 @@ class GenerateReportWidget(widgets.VBox):
             pob_total='POBLACIÓN TOTAL',
         )
 
-        ant_par_2_epsas = [
-            'EPSAS','SAGUAPAC','COSMOL','ELAPAS','SEMAPA',
-            'SELA','COATRI','CAPAG','AAPOS','COSAALT',
-            'EMAPYC','COSPHUL','COSCHAL','COOPAGUAS','COSPAIL',
-            'COOPLAN','EMAAB','LA GUARDIA','COOPAPPI','COSMIN',
-            'EMSABAV','COSPAS','SEAPAS','COSAP','COOPLIM',
-            'MANCHACO','COSEPW',
-        ]
-
         report_number = widgets.BoundedIntText(
             value= profile_json.get('last_report_num',0) + 1,
             min=0, max=999, step=1,
@@ -293,6 +454,7 @@ class GenerateReportWidget(widgets.VBox):
 
         help_grid = qgrid.QGridWidget(df=pd.DataFrame())
         active_tab = widgets.Text(value='general')
+        ready_html = widgets.HTML()
 
         out_name_text = widgets.Text(
             value=f'reporte_poa',
@@ -350,38 +512,8 @@ class GenerateReportWidget(widgets.VBox):
 
         def build_ant():
             ant_pars = ['El Decreto Supremo 071/2009 del 9 de Abril del 2009, Artículo 24, Inciso g), establece como competencia de la AAPS, regular y fiscalizar a los prestadores de servicio en lo referente a planes de operación, mantenimiento, expansión, fortalecimiento del servicio, precio, tarifas y otros.']
-            if epsa_dropdown.value:
-                epsa = epsa_dropdown.value
-                
-            if epsa in ant_par_2_epsas:
-                ant_2_par = f'Manual de Seguimiento de cumplimiento de obligaciones compromisos y procedimientos a seguir de la EPSA {epsa}.'
-            else:
-                ant_2_par = 'Mediante la RAR SISAB Nº 124/2007 del 12 de junio del 2007 se aprueba la guía de solicitud de Licencias y Registros, Manual de Seguimiento de Licencias y Manual para la elaboración del Plan de Desarrollo Quinquenal para licencias.'
-            ant_pars.append(ant_2_par)
-            
-            ant_3_par = ''
-            ant_3_df = None
-            if exists(join(mappings_path,'anexo_3.csv')):
-                ant_3_df = pd.read_csv(join(mappings_path,'anexo_3.csv'))
-            if ant_3_df is not None:
-                if epsa in list(ant_3_df.code):
-                    row = ant_3_df[ant_3_df.code == epsa]
-                    ant_3_par = f'Mediante RAR AAPS Nº {row.number.iloc[0]}, de fecha XXXX, se otorga la Licencia a "{row.name.iloc[0]}".'
-            if ant_3_par:
-                ant_pars.append(ant_3_par)
-
-            ant_4_par = ''
-            ant_4_df = None
-            if exists(join(mappings_path,'anexo_4.csv')):
-                ant_4_df = pd.read_csv(join(mappings_path,'anexo_4.csv'))
-            if ant_4_df is not None:
-                if epsa in list(ant_4_df.code):
-                    row = ant_4_df[ant_4_df.code == epsa]
-                    instructivo_circular = 'del Instructivo' if row.type.iloc[0] == 'instructivo' else 'de la Circular'
-                    ant_4_par = f'A través {instuctivo_circular} AAPS/DER/INS/Nº{row.number.iloc[0]}, de fecha {row.date.iloc[0]}, se comunica a la EPSA el Cronograma de Reporte de Información y Obligaciones de Titulares de Licencia.'
-            if ant_4_par:
-                ant_pars.append(ant_4_par)
-            
+            ant_pars += get_ant_pars(epsa_dropdown.value)
+
             nl = '\n'
             par_list = f'<ul>{nl}{nl.join([f"<li>{par}</li>" for par in ant_pars])}{nl}</ul>'
             return f'Estos son los antecedentes que pudieron ser generados para la EPSA.{nl}<div style="background-color: #ddffff;border-left: 6px solid #2196F3; padding: 0.01em 16px">{nl}{par_list}{nl}</div>'
@@ -393,12 +525,30 @@ class GenerateReportWidget(widgets.VBox):
 
         ant_html = widgets.HTML(value='Selecciona una EPSA para generar los antecedentes.')
 
+        def get_poa_type():
+            return 'coop' if type_toggle.value == 'Cooperativas' else 'muni'
+
+        def load_poa_index():
+            return data_store.key_index('poas',poa_key_cols)
+
+        def load_poa_totals():
+            # tables written before item shares got their own prefix are rebuilt from the POAs
+            if data_store.exists('poa_totals') and set(poa_totals_cols) <= set(data_store.columns('poa_totals')):
+                return data_store.key_index('poa_totals',poa_key_cols)
+            return data_store.derived('poas','totals',lambda df: KeyIndex(build_poa_totals(df),poa_key_cols))
+
+        def get_poa_keys(poa_type):
+            if not data_store.exists('poas'):
+                return pd.DataFrame()
+            return load_poa_index().get(poa_type,columns=general_cols)
+
         def on_type_toggle_change(change):
+            import_excel_cache()
             if change['new'] == 'Cooperativas':
-                if exists(coop_xl_path):
+                help_grid.df = get_poa_keys('coop')
+                if not help_grid.df.empty:
                     help_html.value = ''
-                    help_grid.df = pd.read_excel(coop_xl_path, sheet_name='general')
-                    epsa_dropdown.options = list(help_grid.df.epsa)
+                    epsa_dropdown.options = load_poa_index().options('coop')
                     generate_button.disabled = False
                     generate_random_button.layout.display = 'none'
                 else:
@@ -416,10 +566,10 @@ class GenerateReportWidget(widgets.VBox):
                     help_html.value = "Parece que no tienes datos de Cooperativas. Trata de descargar estos datos desde la aplicación <a href='http://localhost:8888/apps/Actualizar%20o%20Descargar%20Datos.ipynb?appmode_scroll=0' target='_blank'>Actualizar o Descargar Datos</a>. También puedes generar un reporte con datos aleatorios."    
 
             if change['new'] == 'Municipales':
-                if exists(muni_xl_path):
+                help_grid.df = get_poa_keys('muni')
+                if not help_grid.df.empty:
                     help_html.value = ''
-                    help_grid.df = pd.read_excel(muni_xl_path, sheet_name='general')
-                    epsa_dropdown.options = list(help_grid.df.epsa)
+                    epsa_dropdown.options = load_poa_index().options('muni')
                     generate_button.disabled = False
                     generate_random_button.layout.dislpay = 'none'
                 else:
@@ -439,59 +589,57 @@ class GenerateReportWidget(widgets.VBox):
         def on_epsa_dropdown_change(change):
             if change['new']:
                 epsa_dropdown.layout.display = None
-                df = help_grid.df
         #         out_name_text.value = f'reporte_poa_{change["new"]}.docx'
                 year_dropdown.options = []
-                year_dropdown.options = list(df[df.epsa==change['new']].year)
+                year_dropdown.options = load_poa_index().options(get_poa_type(),change['new'])
                 
             ant_html.value = build_ant()
 
         def on_year_dropdown_change(change):
             if change['new']:
                 year_dropdown.layout.display = None
-                df = help_grid.df
                 out_name_text.value = f'reporte_poa_{epsa_dropdown.value}_{change["new"]}'
                 order_dropdown.options = []
-                order_dropdown.options = list(df[(df.epsa==epsa_dropdown.value)&(df.year==change['new'])].order)
+                order_dropdown.options = load_poa_index().options(get_poa_type(),epsa_dropdown.value,change['new'])
+
+        pending_grids = dict()
+        poa_totals = dict(row=None,values=None)
+
+        def show_tab(i):
+            if i in pending_grids:
+                grids[i].df = pending_grids.pop(i)
+
+        def on_tab_change(change):
+            if change['new'] is not None:
+                show_tab(change['new'])
 
         def on_order_dropdown_change(change):
             if change['new']:
                 order_dropdown.layout.display = None
 
-                xl_path = coop_xl_path if type_toggle.value == 'Cooperativas' else muni_xl_path
+                poa_type = get_poa_type()
 
-                sheets = [pd.read_excel(xl_path,sheet_name=sn) for sn in sheet_names]
-                col_lists = [list(s) for s in sheets]
-                df = pd.concat(sheets,axis=1)
-                fdf = df[(df.epsa==epsa_dropdown.value)&(df.year==year_dropdown.value)&(df.order==change['new'])]
-                dfs = [fdf[cl] for cl in col_lists]
+                fdf = load_poa_index().get(poa_type,epsa_dropdown.value,year_dropdown.value,change['new'])
+                dfs = [fdf[cl] for cl in poa_sheet_cols[poa_type]]
 
-                in_op_cols = ['in_op_ap','in_op_alc','in_op_alc_pozo','in_op_otros']
-                in_no_op_cols = ['in_financieros','in_no_op_otros']
-
-                in_op_val = dfs[1][in_op_cols].iloc[0].sum()
-                in_no_op_val = dfs[1][in_no_op_cols].iloc[0].sum()
-                in_total_val = dfs[1].iloc[0].sum()
-                total_gastos_val = dfs[2].iloc[0].sum()
-                total_inv_val = dfs[3].iloc[0].sum()
+                totals = load_poa_totals().get(poa_type,epsa_dropdown.value,year_dropdown.value,change['new']).iloc[0].to_dict()
+                poa_totals.update(row=totals,values=fdf[sum(poa_sheet_cols[poa_type][1:4],[])].iloc[0].to_dict())
 
                 widget_vals = [
-                    (in_op_text,in_op_val,),
-                    (in_no_op_text,in_no_op_val,),
-                    (in_total_text,in_total_val,),
-                    (total_gastos_text,total_gastos_val,),
-                    (total_inv_text,total_inv_val,),
+                    (in_op_text,totals['total_in_op'],),
+                    (in_no_op_text,totals['total_in_no_op'],),
+                    (in_total_text,totals['total_in_total'],),
+                    (total_gastos_text,totals['total_out_total'],),
+                    (total_inv_text,totals['total_inversiones'],),
                 ]
 
-                in_op_percentage.value = '{:.2f}'.format(in_op_val / in_total_val * 100) + '%'
-                in_no_op_percentage.value = '{:.2f}'.format(in_no_op_val / in_total_val * 100) + '%'
+                in_op_percentage.value = '{:.2f}'.format(totals['share_in_op']) + '%'
+                in_no_op_percentage.value = '{:.2f}'.format(totals['share_in_no_op']) + '%'
 
                 if type_toggle.value == 'Municipales':
                     serv_pers_text.layout.display = None
-                    serv_pers_cols = ['gastos_empleados_permanentes','gastos_empleados_no_permanentes','gastos_prevision_social',]
-                    serv_pers_val = dfs[2][serv_pers_cols].iloc[0].sum()
-                    widget_vals.append((serv_pers_text,serv_pers_val,))
-                    serv_pers_percentage.value = '{:.2f}'.format(serv_pers_val/ total_gastos_val * 100) + '%'
+                    widget_vals.append((serv_pers_text,totals['total_serv_pers'],))
+                    serv_pers_percentage.value = '{:.2f}'.format(totals['share_serv_pers']) + '%'
                 if type_toggle.value == 'Cooperativas':
                     serv_pers_text.layout.display = 'none'
                     serv_pers_percentage.value = ''
@@ -512,16 +660,17 @@ class GenerateReportWidget(widgets.VBox):
                 dfs[4].reset_index(level=0,inplace=True)
                 dfs[4].columns = ['Descripción','Valor']
                 
-                for df,total in zip(dfs[1:4],[in_total_val,total_gastos_val,total_inv_val]):
-                    df['%'] = df['Valor (Bs.)'].apply(lambda x: '{:.2f}'.format(x / total * 100))
-                    df['Valor (Bs.)']= df['Valor (Bs.)'].apply(float_to_text)
+                for df,cols in zip(dfs[1:4],poa_sheet_cols[poa_type][1:4]):
+                    df['Valor (Bs.)'] = df['Valor (Bs.)'].astype('float64')
+                    df['%'] = [totals[f'share_item_{c}'] for c in cols]
 
+                dfs[4]['Valor'] = dfs[4]['Valor'].astype('float64')
                 dfs[4]['Unidad'] = ['Hab.']*3 + ['N°']*2 + ['%'] + ['N°']*2 + ['%']*3
-                dfs[4]['Valor'] = dfs[4]['Valor'].apply(float_to_text)
-
-                for grid,df in zip(grids,dfs):
-                    grid.df = df
 
+                pending_grids.update(enumerate(dfs))
+                for grid in grids:
+                    grid.df = pd.DataFrame()
+                show_tab(tab.selected_index or 0)
 
                 for box in [ingresos_text_box, gastos_text_box,inversiones_text_box,expansion_text_box]:
                     box.value = ''
@@ -562,9 +711,13 @@ class GenerateReportWidget(widgets.VBox):
             doc = docxtpl.DocxTemplate(tpl_path)
 
             if not random:
-                income_data, expenses_data, investments_data = [grids[i+1].get_changed_df()['Valor (Bs.)'].apply(text_to_float) for i in range(3)]
-                expansion_data = grids[4].get_changed_df()['Valor'].apply(text_to_float)
-                income_p_data, expenses_p_data, investments_p_data = [grids[i+1].get_changed_df()['%'].apply(text_to_float) for i in range(3)]
+                for i in list(pending_grids):
+                    show_tab(i)
+
+                income_data, expenses_data, investments_data = [grids[i+1].get_changed_df()['Valor (Bs.)'] for i in range(3)]
+                expansion_data = grids[4].get_changed_df()['Valor']
+
+                totals = poa_totals['row']
 
             # Intro
             date = date_picker.value
@@ -574,37 +727,8 @@ class GenerateReportWidget(widgets.VBox):
             name = name_text.value.title() if name_text.value else ''
 
 
-            ant_pars = []
-            epsa =  epsa_dropdown.value
-            if epsa in ant_par_2_epsas:
-                ant_2_par = f'Manual de Seguimiento de cumplimiento de obligaciones compromisos y procedimientos a seguir de la EPSA {epsa}.'
-            else:
-                ant_2_par = 'Mediante la RAR SISAB Nº 124/2007 del 12 de junio del 2007 se aprueba la guía de solicitud de Licencias y Registros, Manual de Seguimiento de Licencias y Manual para la elaboración del Plan de Desarrollo Quinquenal para licencias.'
-            ant_pars.append(ant_2_par)
-            
-            ant_3_par = ''
-            ant_3_df = None
-            if exists(join(mappings_path,'anexo_3.csv')):
-                ant_3_df = pd.read_csv(join(mappings_path,'anexo_3.csv'))
-            if ant_3_df is not None:
-                if epsa in list(ant_3_df.code):
-                    row = ant_3_df[ant_3_df.code == epsa]
-                    ant_3_par = f'Mediante RAR AAPS Nº {row.number.iloc[0]}, de fecha XXXX, se otorga la Licencia a "{row.name.iloc[0]}".'
-            if ant_3_par:
-                ant_pars.append(ant_3_par)
-
-            ant_4_par = ''
-            ant_4_df = None
-            if exists(join(mappings_path,'anexo_4.csv')):
-                ant_4_df = pd.read_csv(join(mappings_path,'anexo_4.csv'))
-            if ant_4_df is not None:
-                if epsa in list(ant_4_df.code):
-                    row = ant_4_df[ant_4_df.code == epsa]
-                    instructivo_circular = 'del Instructivo' if row.type.iloc[0] == 'instructivo' else 'de la Circular'
-                    ant_4_par = f'A través {instuctivo_circular} AAPS/DER/INS/Nº{row.number.iloc[0]}, de fecha {row.date.iloc[0]}, se comunica a la EPSA el Cronograma de Reporte de Información y Obligaciones de Titulares de Licencia.'
-            if ant_4_par:
-                ant_pars.append(ant_4_par)
-            
+            ant_pars = get_ant_pars(epsa_dropdown.value)
+
             context = dict(
                 prof=prof.upper(),
                 day=str(date.day),
@@ -627,50 +751,43 @@ class GenerateReportWidget(widgets.VBox):
                 expansion_paragraphs=expansion_text_box.value.split('\n\n'),
             )
 
-            for i,val,p_val in zip(range(6),income_data.apply(float_to_text),income_p_data.apply(float_to_text)):
+            income_p_data = [totals[f'share_item_{col}'] for col in income_cols]
+            for i,val,p_val in zip(range(6),format_numbers(income_data),format_numbers(income_p_data)):
                 context[f'in_{i+1}'] = val
                 context[f'in_{i+1}_p'] = p_val
 
-            in_labels_indexes = [
-                ('in_op',[0,1,2,3,],),
-                ('in_op_serv',[0,1,],),
-                ('in_op_otros',[2,3,],),
-                ('in_no_op',[4,5,],),
-                ('in_total',[0,1,2,3,4,5,],),
-            ]
-
-            for label,indexes in in_labels_indexes:
-                context[label] = float_to_text(income_data[indexes].sum())
-                context[f'{label}_p'] = float_to_text(income_p_data[indexes].sum())
+            in_labels = ['in_op','in_op_serv','in_op_otros','in_no_op','in_total']
+            in_totals = [totals[f'total_{label}'] for label in in_labels]
+            in_shares = [totals[f'share_{label}'] for label in in_labels]
+            for label,val,p_val in zip(in_labels,format_numbers(in_totals),format_numbers(in_shares)):
+                context[label] = val
+                context[f'{label}_p'] = p_val
 
             if is_coop:
-                num_rows = 5
-                out_labels_indexes = [
-                    ('out_total',[0,1,2,3,4],),
-                    ('costos',[0,1],),
-                    ('gastos',[2,3,4],),
-                ]
+                expenses_cols = coop_expenses_cols
+                out_labels = ['out_total','costos','gastos']
             if is_muni:
-                num_rows = 10
-                out_labels_indexes = [
-                    ('gastos',[0,1,2,3,4,5,6,7,8,9,]),
-                    ('serv_pers',[0,1,2,]),
-                ]
+                expenses_cols = muni_expenses_cols
+                out_labels = ['gastos','serv_pers']
 
-            for i,val,p_val in zip(range(num_rows),expenses_data.apply(float_to_text),expenses_p_data.apply(float_to_text)):
+            expenses_p_data = [totals[f'share_item_{col}'] for col in expenses_cols]
+            for i,val,p_val in zip(range(len(expenses_cols)),format_numbers(expenses_data),format_numbers(expenses_p_data)):
                 context[f'out_{i+1}'] = val
                 context[f'out_{i+1}_p'] = p_val
-            for label,indexes in out_labels_indexes:
-                context[label] = float_to_text(expenses_data[indexes].sum())
-                context[f'{label}_p'] = float_to_text(expenses_p_data[indexes].sum())
-
-            for i,val,p_val in zip(range(5),investments_data.apply(float_to_text),investments_p_data.apply(float_to_text)):
+            out_totals = [totals[f'total_{label}'] for label in out_labels]
+            out_shares = [totals[f'share_{label}'] for label in out_labels]
+            for label,val,p_val in zip(out_labels,format_numbers(out_totals),format_numbers(out_shares)):
+                context[label] = val
+                context[f'{label}_p'] = p_val
+
+            investments_p_data = [totals[f'share_item_{col}'] for col in investments_cols]
+            for i,val,p_val in zip(range(5),format_numbers(investments_data),format_numbers(investments_p_data)):
                 context[f'inv_{i+1}'] = val
                 context[f'inv_{i+1}_p'] = p_val
 
-            context['inversiones'] = float_to_text(investments_data.sum())
+            context['inversiones'] = float_to_text(totals['total_inversiones'])
             
-            for i,val in zip(range(11),expansion_data.apply(float_to_text)):
+            for i,val in zip(range(11),format_numbers(expansion_data)):
                 context[f'exp_{i+1}'] = val
 
             # Finish
@@ -697,84 +814,48 @@ class GenerateReportWidget(widgets.VBox):
                     with open(profile_path,'w') as f:
                         json.dump(profile_json,f)
 
-        format_help ='''<font color="red">
-            El valor editado no se encuentra en un formato de número reconocible.
-            Tuvimos que revertir el valor de la celda al valor antiguo para mantener la consistencia de la tabla.
-            El nuevo valor puede contener dígitos, comas y tan sólo un punto para delimitar los decimales.
-        </font>
-        '''
-
         def on_cell_edited(event,grid):
             col,idx,old,new = [event[key] for key in ['column','index','old','new']]
 
-            if col in ['%','Descripción','Unidad'] or active_tab.value == 'general':
-                changed_df = grid.get_changed_df()
-                changed_df[col][idx] = old
-                grid.df = changed_df
+            if event.get('source') == 'api':
                 return
 
-            try:
-                text_to_float(new)
-                help_html.value = ''
-            except ValueError:
-                changed_df = grid.get_changed_df()
-                changed_df[col][idx] = old
-                grid.df = changed_df
-                help_html.value = format_help
+            if col in ['%','Descripción','Unidad'] or active_tab.value == 'general' or pd.isnull(new):
+                grid.edit_cell(idx,col,old)
                 return
 
             if col == 'Valor':
                 return
-            
-            in_op_idxs = [
-                'SERVICIOS DE AGUA POTABLE',
-                'SERVICIOS DE ALCANTARILLADO',
-                'SERVICIOS DE ALCANTARILLADO DE POZO',
-                'OTROS INGRESOS OPERATIVOS',
-            ] 
-            in_no_op_idxs = [
-                'INGRESOS FINANCIEROS',
-                'OTROS INGRESOS NO OPERATIVOS',
-            ]
-            serv_pers_idxs = [
-                'EMPLEADOS PERMANENTES',
-                'EMPLEADOS NO PERMANENTES',
-                'PREVISIÓN SOCIAL',
-            ]
-            inv_idxs = [
-                'CONSTRUCCIÓN DE INFRAESTRUCTURA SISTEMA AGUA POTABLE',
-                'CONSTRUCCIÓN DE INFRAESTRUCTURA SISTEMA DE ALCANTARILLADO',
-                'ADQUISICIÓN DE MAQUINARIA Y EQUIPO',
-                'DISEÑO Y ESTUDIOS DE PROYECTOS',
-                'OTROS',
-            ]
 
-            df = grid.get_changed_df()
-            df_total = float_to_text(df[col].apply(text_to_float).sum())
-            df['%'][idx] = float_to_text(text_to_float(df['Valor (Bs.)'][idx])/text_to_float(df_total)*100)
+            sheet = tab_name_to_sheet[active_tab.value]
+            item_col = poa_sheet_cols[get_poa_type()][sheet][idx]
+            totals = poa_totals['row']
+            update_poa_totals(totals,poa_totals['values'],item_col,float(new))
+
+            grid.edit_cell(idx,'%',totals[f'share_item_{item_col}'])
 
-            idx_text_percentages = [
-                (in_op_idxs,in_op_text,in_op_percentage),
-                (in_no_op_idxs,in_no_op_text,in_no_op_percentage),
+            label_text_percentages = [
+                ('in_op',in_op_text,in_op_percentage),
+                ('in_no_op',in_no_op_text,in_no_op_percentage),
             ]
 
             if type_toggle.value == 'Municipales':
-                idx_text_percentages.append((serv_pers_idxs,serv_pers_text,serv_pers_percentage,))
+                label_text_percentages.append(('serv_pers',serv_pers_text,serv_pers_percentage,))
 
-            for idxs,text_widget,percentage_widget in idx_text_percentages:
-                if df['Descripción'][idx] in idxs:
-                    new_val = df[df['Descripción'].isin(idxs)]['Valor (Bs.)'].apply(text_to_float).sum()
-                    text_widget.value = float_to_text(new_val)
-                    percentage_widget.value = '{:.2f}'.format(new_val / text_to_float(df_total) * 100) + '%'
+            for label,text_widget,percentage_widget in label_text_percentages:
+                if item_col in poa_total_group_cols[label]:
+                    text_widget.value = float_to_text(totals[f'total_{label}'])
+                    percentage_widget.value = '{:.2f}'.format(totals[f'share_{label}']) + '%'
 
-            tab_names = ['ingresos','gastos','inversiones']
-            total_widgets = [in_total_text,total_gastos_text,total_inv_text]
+            total_label,total_widget = sheet_to_total[sheet]
+            total_widget.value = float_to_text(totals[f'total_{total_label}'])
 
-            for tab_name,total_widget in zip(tab_names, total_widgets):
-                if active_tab.value == tab_name:
-                    total_widget.value = df_total
-
-            grid.df = df
+        tab_name_to_sheet = dict(ingresos=1,gastos=2,inversiones=3)
+        sheet_to_total = {
+            1: ('in_total',in_total_text),
+            2: ('out_total',total_gastos_text),
+            3: ('inversiones',total_inv_text),
+        }
 
         def on_generate_random_button_click(b):
             on_generate_button_click(b,random=True)
@@ -820,7 +901,7 @@ class GenerateReportWidget(widgets.VBox):
         tab_names = [sn.title() for sn in sheet_names]
         grids = []
         for i in range(len(tab_names)):
-            grids.append(qgrid.QGridWidget(df=pd.DataFrame(),show_toolbar=False,))
+            grids.append(qgrid.QGridWidget(df=pd.DataFrame(),show_toolbar=False,precision=2,))
 
         for i,val in zip(range(5),['general','ingresos','gastos','inversiones','expansión']):
             grids[i].on('selection_changed',update_active_tab(val))
@@ -853,6 +934,7 @@ class GenerateReportWidget(widgets.VBox):
 
         for i,name in enumerate(tab_names):
             tab.set_title(i, name)
+        tab.observe(on_tab_change,names='selected_index')
 
         accordion = widgets.Accordion([
             widgets.HBox([widgets.VBox([
@@ -864,7 +946,7 @@ class GenerateReportWidget(widgets.VBox):
                 date_picker,
                 widgets.HBox([save_profile_button,intro_help_html,]),
             ]),intro_html]),
-            widgets.VBox([type_toggle, epsa_dropdown, year_dropdown, order_dropdown,]),
+            widgets.VBox([widgets.HBox([type_toggle,ready_html,]), epsa_dropdown, year_dropdown, order_dropdown,]),
             ant_html,
         ])
         accordion.set_title(0, '1. Datos Generales / Intro')
@@ -881,6 +963,9 @@ class GenerateReportWidget(widgets.VBox):
             help_html,
         ]
 
+        if data_store.exists('poas') or has_excel_cache():
+            start_warm_up([import_excel_cache,lambda: load_poa_index().options(),load_poa_totals],ready_html)
+
         super().__init__(children=children, **kwargs)
         
 class DataManagementWidget(widgets.VBox):
@@ -896,52 +981,13 @@ class DataManagementWidget(widgets.VBox):
 
         def get_local_datasets():
             local_datasets = []
-            if exists(epsas_xl_path):
-                local_datasets.append('EPSAS')
-            if exists(coop_xl_path) and exists(muni_xl_path):
-                local_datasets.append('POAS')
-            if exists(indicators_xl_path) and exists(measurements_xl_path):
-                local_datasets.append('INDICADORES')
-            if exists(variables_xl_path) and exists(variables_xl_path):
-                local_datasets.append('VARIABLES')
+            for ds_name in available_datasets:
+                if data_store.exists(*dataset_name_to_keys[ds_name]):
+                    local_datasets.append(ds_name)
             return local_datasets
 
-        general_cols = ['epsa','year','order']
-        income_cols = ['in_op_ap','in_op_alc','in_op_alc_pozo','in_op_otros','in_financieros','in_no_op_otros']
-        coop_expenses_cols = [
-            'costos_operacion',
-            'costos_mantenimiento',
-            'gastos_administrativos',
-            'gastos_comerciales',
-            'gastos_financieros',
-        ]
-        muni_expenses_cols = [
-            'gastos_empleados_permanentes',
-            'gastos_empleados_no_permanentes',
-            'gastos_prevision_social',
-            'gastos_servicio_no_personales',
-            'gastos_materiales',
-            'gastos_activos',
-            'gastos_deuda_publica',
-            'gastos_transferencias',
-            'gastos_impuesto',
-            'gastos_otros',
-        ]
-        investments_cols = [
-            'inv_infraestructura_ap',
-            'inv_infraestructura_alc',
-            'inv_equipo',
-            'inv_diseno_estudio',
-            'inv_otros',
-        ]
-
-        expansion_cols = [
-            'pob_total','pob_ap','pob_alc','con_ap','con_ap_total',
-            'cob_ap','con_alc','con_alc_total','cob_alc','cob_micro',
-            'anc',
-        ]
-
         help_html0 = widgets.HTML()
+        excel_import_html = widgets.HTML()
 
         username_widget = widgets.Text(
             description='Usuario:',
@@ -1005,6 +1051,42 @@ class DataManagementWidget(widgets.VBox):
             layout=widgets.Layout(width='100%'),
             style={'description_width': 'initial'},
         )
+        concurrency_text = widgets.BoundedIntText(
+            value=max_concurrent_downloads,
+            min=1, max=len(api_set_keys), step=1,
+            description='Descargas simultáneas:',
+            tooltip=f'entre 1 y {len(api_set_keys)}',
+            layout=widgets.Layout(width='250px'),
+            style={'description_width': 'initial'},
+        )
+        page_size_text = widgets.BoundedIntText(
+            value=default_page_size,
+            min=100, max=100000, step=100,
+            description='Registros por página:',
+            tooltip='Cantidad de registros solicitados por página al servidor',
+            layout=widgets.Layout(width='250px'),
+            style={'description_width': 'initial'},
+        )
+        incremental_checkbox = widgets.Checkbox(
+            value=True,
+            description='Sincronización incremental',
+            tooltip='Descarga sólo los registros modificados desde la última sincronización.',
+            style={'description_width': 'initial'},
+        )
+        excel_checkbox = widgets.Checkbox(
+            value=False,
+            description='Exportar también a Excel',
+            tooltip='Guarda una copia de los datos en archivos .xlsx dentro de la carpeta datos.',
+            style={'description_width': 'initial'},
+        )
+        store_backend_dropdown = widgets.Dropdown(
+            options=store_backends,
+            value=get_store_backend(),
+            description='Almacenamiento local:',
+            tooltip='Formato en el que se guardan los conjuntos de datos descargados.',
+            layout=widgets.Layout(width='300px'),
+            style={'description_width': 'initial'},
+        )
         download_button = widgets.Button(
             description='Actualizar/Descargar Datos',
             button_style='success',
@@ -1014,6 +1096,14 @@ class DataManagementWidget(widgets.VBox):
             layout=widgets.Layout(width='300px',height='50px',font_size='20px'),
         )
 
+        rollback_button = widgets.Button(
+            description='Restaurar anterior',
+            button_style='warning',
+            tooltip='Vuelve a los datos de la sincronización anterior',
+            icon='undo',
+            layout=widgets.Layout(width='200px',height='50px',display=None if hasattr(data_store,'rollback') else 'none'),
+        )
+
         progress_widgets = dict()
         progress_widgets_html = dict()
         for set_key in api_set_keys:
@@ -1030,6 +1120,7 @@ class DataManagementWidget(widgets.VBox):
                 layout = widgets.Layout(display='none')
             )
 
+        api_client = AAPSClient(server_base_url,pool_size=len(api_set_keys),spool_path=spool_path)
 
 
         class SelectFileButton(widgets.Button):
@@ -1116,9 +1207,12 @@ class DataManagementWidget(widgets.VBox):
 
         download_data_widget = widgets.VBox(children=[
             download_help,
+            excel_import_html,
             widgets.HBox([local_datasets_select,external_datasets_select,]),
             widgets.HBox([overview_html,progress_box]),
-            widgets.HBox([download_button,button_help,]),
+            widgets.HBox([concurrency_text,page_size_text,incremental_checkbox,excel_checkbox,]),
+            store_backend_dropdown,
+            widgets.HBox([download_button,rollback_button,button_help,]),
         ], layout=widgets.Layout(display='none'))
 
 
@@ -1153,13 +1247,17 @@ class DataManagementWidget(widgets.VBox):
 
             username = username_widget.value
             password = password_widget.value
-            r = requests.post(f'{server_base_url}/api-token-auth/', json={'username':username, 'password':password})
+            try:
+                r_json = api_client.get_token(username,password)
+            except (ConnectionError, Timeout, HTTPError, ValueError):
+                help_html.value = "<font color='red'>No se pudo establecer conexión con el servidor de datos.</font>"
+                return
 
-            if 'token' in r.json().keys():
+            if 'token' in r_json.keys():
                 with open(profile_path,'r') as f:
                     profile_json_h = json.load(f)
 
-                profile_json_h['token'] = r.json()['token']
+                profile_json_h['token'] = api_client.token = r_json['token']
 
                 with open(profile_path,'w') as f:
                     json.dump(profile_json_h,f)
@@ -1201,120 +1299,178 @@ class DataManagementWidget(widgets.VBox):
                 help_html0.value = "<font color='green'>Credenciales de autorización encontrados. Todo listo para descargar datos! Si no puedes descargar datos es posible que tu token este desactualizado.</font>"
                 update_token_button.layout.display=None
 
+        def on_store_backend_dropdown_change(change):
+            global data_store
+            new_store = make_data_store(change['new'])
+            # sync_state.json is shared by both backends and describes the store in use, so every set
+            # is copied over; sets the new store has from an older sync are fetched in full next time
+            sync_state = load_sync_state()
+            stale_set_keys = []
+            with new_store.transaction() as snapshot:
+                for set_key in api_set_keys:
+                    if data_store.exists(set_key):
+                        write_dataset(snapshot,set_key,data_store.read(set_key))
+                    elif new_store.exists(set_key) and set_key in sync_state:
+                        sync_state.pop(set_key)
+                        stale_set_keys.append(set_key)
+            if stale_set_keys:
+                save_sync_state(sync_state)
+            data_store = new_store
+            rollback_button.layout.display = None if hasattr(data_store,'rollback') else 'none'
+
+            with open(profile_path,'r') as f:
+                profile_json = json.load(f)
+            profile_json['store_backend'] = change['new']
+            with open(profile_path,'w') as f:
+                json.dump(profile_json,f)
+
+            local_datasets_select.options = get_local_datasets()
+            external_datasets_select.options=difference(available_datasets,get_local_datasets())
+            build_overview()
+            if stale_set_keys:
+                stale_names = ', '.join(set_key_to_verbose[sk] for sk in stale_set_keys)
+                button_help.value = f'<font size=3>La próxima actualización descargará completos: {stale_names}.</font>'
+
+        def on_rollback_button_click(b):
+            if data_store.rollback():
+                save_sync_state({})
+                local_datasets_select.options = get_local_datasets()
+                external_datasets_select.options=difference(available_datasets,get_local_datasets())
+                build_overview()
+                button_help.value = '<font size=3>Se restauraron los datos de la sincronización anterior. La próxima actualización descargará los conjuntos completos.</font>'
+            else:
+                button_help.value = '<font color="red">No hay una sincronización anterior para restaurar.</font>'
+
         def on_local_dataset_select_change(change):
             build_overview()
         def on_external_dataset_select_change(change):
             build_overview()
 
-        def get_response(set_key,headers):
-            with requests.get(f'{server_base_url}/api/{set_key}/?fields!=id,modified',headers=headers,stream=True) as r:
-                content_length = int(r.headers.get('Content-length'))
-                c_size = content_length/100
-                w = progress_widgets[set_key]
-                w_html = progress_widgets_html[set_key]
-                w.value = 0
-                w_html.value = f'0 kb / {"{:,.0f}".format(content_length/1000)} kb (0%)'
-                b_json = bytes()
-                downloaded = 0
-                for chunk in r.iter_content(chunk_size=int(c_size)):
-                    w.value += 1
-                    downloaded = downloaded + c_size if downloaded + c_size < content_length else content_length
-                    w_html.value = f'{"{:,.0f}".format(downloaded/1000)} kb / {"{:,.0f}".format(content_length/1000)} kb ({w.value}%)'
-                    b_json += chunk
-                    
-            return json.loads(b_json.decode('utf-8'))
+        def get_response(set_key,since=None):
+            w = progress_widgets[set_key]
+            w_html = progress_widgets_html[set_key]
+
+            def on_progress(done,total,unit,decoded=None):
+                if unit == 'bytes':
+                    done_text, total_text = [f'{"{:,.0f}".format(x/1000)} kb' if x is not None else '??' for x in [done,total]]
+                else:
+                    done_text, total_text = [f'{"{:,.0f}".format(x)} registros' if x is not None else '??' for x in [done,total]]
+                if total:
+                    w.value = min(int(done/total*100),100)
+                    progress_text = f'{done_text} / {total_text} ({w.value}%)'
+                else:
+                    progress_text = f'{done_text} / {total_text}'
+                if decoded and decoded != done:
+                    progress_text += f' <font color="gray">{"{:,.0f}".format(decoded/1000)} kb descomprimidos</font>'
+                w_html.value = progress_text
+
+            w.value = 0
+            w.bar_style = 'info'
+            response = download_set(api_client,set_key,since=since,on_progress=on_progress,page_size=page_size_text.value)
+            if 'df' in response:
+                w.value = 100
+            return response
 
         def on_download_button_click(b):
+            import_excel_cache()
             with open(profile_path,'r') as f:
-                token = json.load(f).get('token')
-            headers = dict(Authorization=f'Token {token}')
+                api_client.token = json.load(f).get('token')
             selected_datasets = local_datasets_select.value + external_datasets_select.value
-            try:
-                response_jsons = {}
-                for set_name in list(dataset_name_to_keys):
-                    if set_name in selected_datasets:
-                        for set_key in dataset_name_to_keys[set_name]:
-                            response_jsons[set_key] = get_response(set_key,headers)
-            except ConnectionError:
-                try:
-                    requests.head('http://www.google.com', verify=False, timeout=5)
+            set_keys = []
+            for set_name in list(dataset_name_to_keys):
+                if set_name in selected_datasets:
+                    set_keys += dataset_name_to_keys[set_name]
+
+            sync_state = load_sync_state() if incremental_checkbox.value else {}
+            since = {}
+            for set_key in set_keys:
+                if data_store.exists(set_key) and set_key in set_key_to_index_cols:
+                    since[set_key] = sync_state.get(set_key)
+
+            responses = {}
+            failed_set_keys = []
+            if set_keys:
+                with ThreadPoolExecutor(max_workers=concurrency_text.value) as executor:
+                    futures = {set_key: executor.submit(get_response,set_key,since.get(set_key)) for set_key in set_keys}
+                    for set_key,future in futures.items():
+                        try:
+                            responses[set_key] = future.result()
+                        except Exception:
+                            progress_widgets[set_key].bar_style = 'danger'
+                            failed_set_keys.append(set_key)
+
+            if failed_set_keys and not responses:
+                if api_client.is_online():
                     button_help.value = '<font color="red">No se pudo establecer conexión con el servidor de datos.</font>'
-                except ConnectionError:
-                    NETWORK_CONNECTED = False
+                else:
                     button_help.value = '<font color="red">No se pudo establecer conexión con el servidor de datos. Verifica que tienes conexión a internet e intentalo nuevamente.</font>'
                 return
 
             INVALID_TOKEN = None
-            for k,response_json in response_jsons.items():
-                if isinstance(response_json,dict):
-                    if response_json.get('detail') == 'Token inválido.':
-                        INVALID_TOKEN = True
+            for k,response in responses.items():
+                if response.get('detail') == 'Token inválido.':
+                    INVALID_TOKEN = True
             if INVALID_TOKEN:
                 download_help.value = '<font color="red">Credenciales inválidas. Actualiza tus credenciales en el paso 1 y trata de nuevo.</font>'
                 download_data_widget.layout.display = 'none'
                 return
 
-            if response_jsons != {} and not exists(data_path):
+            if responses != {} and not exists(data_path):
                 os.makedirs(data_path)
 
-            epsas_json = response_jsons.get('epsas')
-            if isinstance(epsas_json,list):
-                cols = ['code','name','state','category']
-                pd.DataFrame(epsas_json)[cols].to_excel(epsas_xl_path)
-
-            set_keys = ['indicators','measurements','variables','reports']
-            xl_paths =[indicators_xl_path,measurements_xl_path,variables_xl_path,reports_xl_path]
-
-            for set_key, xl_path in zip(set_keys,xl_paths):
-                data_json = response_jsons.get(set_key)
-                if isinstance(data_json,list):
-                    pd.DataFrame(data_json).to_excel(xl_path)
-
-            poas_json = response_jsons.get('poas')
-            if isinstance(poas_json,list):
-                coop_writer = pd.ExcelWriter(coop_xl_path)
-                muni_writer = pd.ExcelWriter(muni_xl_path)
-
-                poas_clean = dict(coop=[],muni=[])
-                for poa in poas_json:
-                    cm_dicts = [poa.get('coop_expense'),poa.get('muni_expense')]
-
-                    for cm_dict,cm in zip(cm_dicts,['coop','muni']):
-                        if isinstance(cm_dict,dict):
-                            for k,v in cm_dict.items():
-                                if not k == 'modified':
-                                    poa[k] = v
-                            del poa['coop_expense']
-                            del poa['muni_expense']
-                            poas_clean[cm].append(poa)
-
-                coop_df = pd.DataFrame(poas_clean['coop'])
-                muni_df = pd.DataFrame(poas_clean['muni'])
-
-                cols_lists = [general_cols,income_cols,None,investments_cols,expansion_cols]
-                sheet_names = ['general','ingresos','gastos','inversiones','metas expansión']
-
-                for cols_list,sn in zip(cols_lists, sheet_names):
-                    if sn == 'gastos':
-                        coop_df[coop_expenses_cols].to_excel(coop_writer,sn,index=False)
-                        muni_df[muni_expenses_cols].to_excel(muni_writer,sn,index=False)
-                    else:
-                        coop_df[cols_list].to_excel(coop_writer,sn,index=False)
-                        muni_df[cols_list].to_excel(muni_writer,sn,index=False)
-
-                if not exists(data_path):
-                    os.makedirs(data_path)
-
-                coop_writer.save()
-                muni_writer.save()
+            new_sync_state = load_sync_state()
+            memory_rows = []
+            written = {}
+
+            with data_store.transaction() as snapshot:
+                for set_key,response in responses.items():
+                    if 'df' not in response:
+                        progress_widgets[set_key].bar_style = 'danger'
+                        failed_set_keys.append(set_key)
+                        continue
+                    df = response['df']
+                    if since.get(set_key):
+                        try:
+                            df = merge_by_key(data_store.read(set_key),df,set_key_to_index_cols[set_key])
+                        except KeyError:
+                            progress_widgets[set_key].bar_style = 'danger'
+                            failed_set_keys.append(set_key)
+                            new_sync_state.pop(set_key,None)
+                            continue
+                    write_dataset(snapshot,set_key,df)
+                    written[set_key] = df
+                    new_sync_state[set_key] = response['hwm']
+                    memory_rows.append((set_key_to_verbose[set_key],)+response['memory'])
+
+            if responses != {}:
+                save_sync_state(new_sync_state)
+
+            # the optional xlsx copies are written once the snapshot is committed, so a workbook
+            # left open in Excel can't roll back the sync
+            export_failed_set_keys = []
+            if excel_checkbox.value:
+                for set_key,df in written.items():
+                    try:
+                        export_to_excel(set_key,df)
+                    except Exception:
+                        export_failed_set_keys.append(set_key)
 
             local_datasets_select.options = get_local_datasets()
             external_datasets_select.options=difference(available_datasets,get_local_datasets())
 
             build_overview()
 
-            if not selected_datasets == []: 
+            if failed_set_keys:
+                failed_names = ', '.join(set_key_to_verbose[sk] for sk in failed_set_keys)
+                button_help.value = f'<font color="red">No se pudieron descargar: {failed_names}. Los demás conjuntos fueron actualizados; intenta nuevamente para completar la descarga.</font>'
+            elif not selected_datasets == []: 
                 button_help.value = '<font size=3>Datos Actualizados/Descargados. Los puedes encontrar en la carpeta <a href="http://localhost:8888/tree/datos/" target=_><code><font color="#fcb070">datos</font></code></a> y ahora los puedes usar en las otras aplicaciones! Por ejemplo: <a href="http://localhost:8888/apps/Generar%20Reportes%20POA.ipynb?appmode_scroll=0" target=_><font color="#fcb070">Generar Reportes POA</font></a></font>'
+                if memory_rows:
+                    button_help.value += '<br><font color="gray">Memoria: ' + '; '.join(format_memory_report(memory_rows)) + '</font>'
+
+            if export_failed_set_keys:
+                failed_names = ', '.join(set_key_to_verbose[sk] for sk in export_failed_set_keys)
+                button_help.value += f'<br><font color="red">No se pudieron exportar a Excel: {failed_names}. Cierra los archivos abiertos en Excel e intenta nuevamente.</font>'
 
         def check_validity(file_path):
             if not zipfile.is_zipfile(file_path):
@@ -1416,6 +1572,8 @@ class DataManagementWidget(widgets.VBox):
         local_datasets_select.observe(on_local_dataset_select_change,names='value')
         external_datasets_select.observe(on_external_dataset_select_change,names='value')
         download_button.on_click(on_download_button_click)
+        rollback_button.on_click(on_rollback_button_click)
+        store_backend_dropdown.observe(on_store_backend_dropdown_change,names='value')
 
         select_file_button.on_click(on_select_file_button_click)
 
@@ -1448,6 +1606,15 @@ class DataManagementWidget(widgets.VBox):
             download_button.disabled = False
             data_accordion.selected_index = 1
 
+        def refresh_local_datasets():
+            import_excel_cache()
+            local_datasets_select.options = get_local_datasets()
+            external_datasets_select.options = difference(available_datasets,get_local_datasets())
+            build_overview()
+
+        if has_excel_cache():
+            start_warm_up([refresh_local_datasets],excel_import_html)
+
         super().__init__(children=[data_accordion],**kwargs)
 
 
@@ -1472,35 +1639,6 @@ class GenerateAnualReportWidget(widgets.VBox):
             pob_total='POBLACIÓN TOTAL',
         )
 
-        def text_to_float(x):
-            return float(x.replace(',',''))
-        def float_to_text(x):
-            try:
-                return "{:,.2f}".format(x)
-            except TypeError:
-                return "-"
-
-        def get_filtered(df,epsa=None,year=None,cols=None):
-            try:
-                epsa_condition = df.epsa==epsa if epsa else len(rdf.epsa)*True
-                year_condition = df.year==year if year else len(rdf.year)*True
-                columns = cols if cols else list(df)
-                return df[epsa_condition&year_condition][columns]
-            except AttributeError:
-                return df
-
-        def val_diff(a,b):
-            try:
-                return b - a
-            except TypeError:
-                return None
-
-        def val_perc(prog,ejec):
-            try:
-                return (ejec / prog) * 100
-            except TypeError:
-                return None
-
         if exists(profile_path):
             with open(profile_path,'r') as f:
                 profile_json = json.load(f)
@@ -1510,19 +1648,6 @@ class GenerateAnualReportWidget(widgets.VBox):
         technical_ind_ids = [i+1 for i in range(22)]
         economical_ind_ids = [i+23 for i in range(10)]
 
-        cat_to_par_min = {cat : f'par_min_{cat}' for cat in ['A','B','C','D',]}
-        cat_to_par_max = {cat : f'par_max_{cat}' for cat in ['A','B','C','D',]}
-
-        def parameters_to_text(par_min,par_max):
-            par_text = f'Entre {par_min} y {par_max}'
-            if par_min == par_max:
-                par_text = str(par_min)
-            if pd.isnull(par_min) and not pd.isnull(par_max):
-                par_text = f'<= al {par_max}'
-            if pd.isnull(par_max) and not pd.isnull(par_min):
-                par_text = f'>= al {par_min}'
-            return par_text
-
         report_number = widgets.BoundedIntText(
             value= profile_json.get('last_report_num',0) + 1,
             min=0, max=999, step=1,
@@ -1590,6 +1715,7 @@ class GenerateAnualReportWidget(widgets.VBox):
             layout=widgets.Layout(width='50%',display='none')
         )
         load_data_help = widgets.HTML()
+        no_data_help = 'Parece que no cuentas con Datos... Descarga o Actualiza los conjuntos de datos "EPSAS" e "INDICADORES", "VARIABLES" y "POAS" con la siguiente herramienta y luego haz click en el botón "CONTINUAR".'
         help_html = widgets.HTML()
         intro_help_html = widgets.HTML()
         continue_button = widgets.Button(
@@ -1638,10 +1764,7 @@ class GenerateAnualReportWidget(widgets.VBox):
         download_tag = widgets.HTML()
 
         epsas_help_grid = qgrid.QGridWidget(df=pd.DataFrame())
-        indicators_help_grid = qgrid.QGridWidget(df=pd.DataFrame())
-        measurements_help_grid = qgrid.QGridWidget(df=pd.DataFrame())
-        reports_help_grid = qgrid.QGridWidget(df=pd.DataFrame())
-        expansion_help_grid = qgrid.QGridWidget(df=pd.DataFrame())
+        ready_html = widgets.HTML()
 
         def update_intro(change):
             intro_html.value = build_intro()
@@ -1659,78 +1782,75 @@ class GenerateAnualReportWidget(widgets.VBox):
 
                 intro_help_html.value = 'Perfil guardado!'
 
-        def on_continue_button_click(b):
-            if all([exists(path) for path in xl_paths]):
-                load_data_help.value = ''
-                epsas_help_grid.df = epsas_df = pd.read_excel(epsas_xl_path)
-                indicators_help_grid.df = pd.read_excel(indicators_xl_path)
-                measurements_help_grid.df = pd.read_excel(measurements_xl_path)
-                reports_help_grid.df = pd.read_excel(reports_xl_path)
+        def load_datasets():
+            load_data_help.value = ''
+            epsas_help_grid.df = data_store.read('epsas')
 
-                sheet_names = ['general','metas expansión']
-                coop_df = pd.concat([pd.read_excel(coop_xl_path,sheet_name=sn) for sn in sheet_names],axis=1)
-                muni_df = pd.concat([pd.read_excel(muni_xl_path,sheet_name=sn) for sn in sheet_names],axis=1)
-                expansion_help_grid.df = coop_df.append(muni_df)
+            epsa_dropdown.options = list(epsas_help_grid.df.code)
+            epsa_dropdown.layout.display = None
 
-                epsa_dropdown.options = list(epsas_help_grid.df.code)
-                epsa_dropdown.layout.display = None
-                
-                year_dropdown.options = list(measurements_help_grid.df.year.unique())
-                year_dropdown.layout.display = None
-                
-                load_data_button.layout.display = None
+            year_dropdown.options = data_store.key_index('measurements',['epsa','year']).options(epsa_dropdown.value)
+            year_dropdown.layout.display = None
+
+            load_data_button.layout.display = None
+
+        def on_annual_epsa_dropdown_change(change):
+            if change['new'] and data_store.exists('measurements'):
+                year_dropdown.options = data_store.key_index('measurements',['epsa','year']).options(change['new'])
+
+        def on_accordion_change(change):
+            if change['new'] == 1 and not epsa_dropdown.options:
+                load_datasets()
+
+        def on_continue_button_click(b):
+            import_excel_cache()
+            if data_store.exists(*api_set_keys):
+                load_datasets()
+                load_data_help.value = ''
                 load_widget.layout.display = 'none'
                 continue_button.layout.display = 'none'
+            else:
+                load_data_help.value = no_data_help
+                load_widget.layout.display = None
 
-        def on_load_data_button_click(b):
-            epsa = epsa_dropdown.value
-            year = year_dropdown.value
-            years = list(range(year-2,year+1))
-
+        def build_indicators_df(epsa,years,ind_ids):
             epsas_df = epsas_help_grid.df
-            indicators_df = indicators_help_grid.df
-            mdf = measurements_help_grid.df
-            rdf = reports_help_grid.df
-            edf = expansion_help_grid.df
+            indicators_df = data_store.read('indicators')
+            par_texts = data_store.derived('indicators','par_text',build_parameter_texts)
+            matrix = data_store.derived('measurements','matrix',build_indicator_matrix)
 
             category = epsas_df[epsas_df.code==epsa].category.iloc[0]
 
-            tec_df = indicators_df[indicators_df.ind_id.isin(technical_ind_ids)].copy()
-            eco_df = indicators_df[indicators_df.ind_id.isin(economical_ind_ids)].copy()
-
-            tec_df['par_text'] = [parameters_to_text(p_min,p_max) for p_min,p_max in zip(tec_df[cat_to_par_min[category]],tec_df[cat_to_par_max[category]])]
-            eco_df['par_text'] = [parameters_to_text(p_min,p_max) for p_min,p_max in zip(eco_df[cat_to_par_min[category]],eco_df[cat_to_par_max[category]])]
-            
-            tec_df['Análisis'] = [''] * len(technical_ind_ids)
-            eco_df['Análisis'] = [''] * len(economical_ind_ids)
-
-            tec_measurements_cols = [f'ind{ind_id}' for ind_id in technical_ind_ids]
-            eco_measurements_cols = [f'ind{ind_id}' for ind_id in economical_ind_ids]
+            ind_df = indicators_df[indicators_df.ind_id.isin(ind_ids)].copy()
+            ind_df['par_text'] = par_texts[category].reindex(ind_df.ind_id).to_numpy()
+            ind_df['Análisis'] = [''] * len(ind_df)
 
+            values = matrix.loc[epsa].reindex(index=ind_df.ind_id,columns=years)
             for year in years:
-                tec_df[str(year)] = list(mdf[(mdf.epsa==epsa)&(mdf.year==year)][tec_measurements_cols].iloc[0])
-                eco_df[str(year)] = list(mdf[(mdf.epsa==epsa)&(mdf.year==year)][eco_measurements_cols].iloc[0])
+                ind_df[str(year)] = to_float64(values[year]).to_numpy()
 
             indicators_cols = ['name','unit','par_text'] + [str(y) for y in years] + ['Análisis']
-            grids[0].df = tec_df[indicators_cols]
-            grids[1].df = eco_df[indicators_cols]
+            return ind_df[indicators_cols]
+
+        def build_expansion_df(epsa,years):
+            measurements = data_store.key_index('measurements',['epsa','year'])
+            reports = data_store.key_index('reports',['epsa','year'])
+            poas = data_store.key_index('poas',['epsa','year','order'])
 
-            sheet_names = ['general','metas expansión']
-            expansion_cols = ['pob_total','pob_ap','pob_alc','con_ap','con_ap_total','cob_ap','con_alc','con_alc_total','cob_alc','cob_micro','anc']
             executed_vals = len(expansion_cols)*[None]
 
-            expansion_df = get_filtered(edf,epsa,years[-1],expansion_cols)
+            expansion_df = poas.get(epsa,years[-1],columns=expansion_cols)
 
             if expansion_df.empty:
-                expansion_df = expansion_df.append(pd.DataFrame([[None]*len(expansion_cols)],columns=expansion_cols))
+                expansion_df = pd.DataFrame([[np.nan]*len(expansion_cols)],columns=expansion_cols)
 
             expansion_df.columns = [column_name_to_verbose[cn] for cn in expansion_cols]
-            expansion_df = expansion_df.transpose().copy()
+            expansion_df = expansion_df.transpose().astype('float64')
 
             expansion_df.columns= ['programado (POA)']
 
             try:
-                expansion_vals_from_reports = list(get_filtered(rdf,epsa,years[-1],[f'v{vid}' for vid in [22,23,24,17,18,]]).iloc[0])
+                expansion_vals_from_reports = list(reports.get(epsa,years[-1],columns=[f'v{vid}' for vid in [22,23,24,17,18,]]).iloc[0])
             except IndexError:
                 expansion_vals_from_reports = [None] * 5
 
@@ -1738,7 +1858,7 @@ class GenerateAnualReportWidget(widgets.VBox):
                 executed_vals[i] = val
 
             try:
-                expansion_vals_from_measurements =list(get_filtered(mdf,epsa,years[-1],['ind7','ind8','ind9','ind18']).iloc[0])
+                expansion_vals_from_measurements =list(measurements.get(epsa,years[-1],columns=['ind7','ind8','ind9','ind18']).iloc[0])
             except IndexError:
                 expansion_vals_from_measurements = [None] * 4
 
@@ -1746,21 +1866,44 @@ class GenerateAnualReportWidget(widgets.VBox):
                 executed_vals[i] = val
 
             try:
-                executed_vals[3] = (get_filtered(rdf,epsa,years[-1],['v17']).iloc[0] - get_filtered(rdf,epsa,years[-2],['v17']).iloc[0]).iloc[0]
-                executed_vals[6] = (get_filtered(rdf,epsa,years[-1],['v18']).iloc[0] - get_filtered(rdf,epsa,years[-2],['v18']).iloc[0]).iloc[0]
+                executed_vals[3] = (reports.get(epsa,years[-1],columns=['v17']).iloc[0] - reports.get(epsa,years[-2],columns=['v17']).iloc[0]).iloc[0]
+                executed_vals[6] = (reports.get(epsa,years[-1],columns=['v18']).iloc[0] - reports.get(epsa,years[-2],columns=['v18']).iloc[0]).iloc[0]
             except IndexError:
                 pass
 
-            expansion_df['ejecutado'] = executed_vals
-            expansion_df['diferencia'] = expansion_df.apply(lambda row: val_diff(row['programado (POA)'],row['ejecutado']), axis=1)
-            expansion_df['%'] = expansion_df.apply(lambda row: val_perc(row['programado (POA)'],row['ejecutado']), axis=1)
+            expansion_df['ejecutado'] = pd.to_numeric(pd.Series(executed_vals,index=expansion_df.index,dtype=object)).astype('float64')
+            expansion_df['diferencia'] = expansion_df['ejecutado'] - expansion_df['programado (POA)']
+            expansion_df['%'] = expansion_df['ejecutado'] / expansion_df['programado (POA)'] * 100
+
+            return expansion_df
+
+        pending_grids = dict()
 
-            for col in ['programado (POA)','ejecutado','diferencia','%']:
-                expansion_df[col] = expansion_df[col].apply(float_to_text)
+        def show_tab(i):
+            if i in pending_grids:
+                grids[i].df = pending_grids.pop(i)()
 
-            grids[2].df = expansion_df
+        def on_tab_change(change):
+            if change['new'] is not None:
+                show_tab(change['new'])
+
+        def on_load_data_button_click(b):
+            epsa = epsa_dropdown.value
+            year = year_dropdown.value
+            years = list(range(year-2,year+1))
+
+            pending_grids[0] = lambda: build_indicators_df(epsa,years,technical_ind_ids)
+            pending_grids[1] = lambda: build_indicators_df(epsa,years,economical_ind_ids)
+            pending_grids[2] = lambda: build_expansion_df(epsa,years)
+            for grid in grids:
+                grid.df = pd.DataFrame()
+
+            show_tab(tab.selected_index or 0)
 
         def on_generate_button_click(b):
+            for i in list(pending_grids):
+                show_tab(i)
+
             doc = docxtpl.DocxTemplate(anual_tpl_path)
             year = year_dropdown.value
             years = [str(y) for y in range(year-2,year+1)]
@@ -1794,15 +1937,15 @@ class GenerateAnualReportWidget(widgets.VBox):
             )
 
             for j,data in enumerate([ind_t_1_data,ind_t_2_data,ind_t_3_data]):
-                for i,val in enumerate(data):
+                for i,val in enumerate(format_numbers(data)):
                     context[f'ind_t_{j+1}_{i+1}'] = val
                     
             for j,data in enumerate([ind_e_1_data,ind_e_2_data,ind_e_3_data]):
-                for i,val in enumerate(data):
+                for i,val in enumerate(format_numbers(data)):
                     context[f'ind_e_{j+1}_{i+1}'] = val
                     
             for pre,data in zip(['p','e','d','r'],[exp_p_data,exp_e_data,exp_d_data,exp_r_data]):
-                for i,val in enumerate(data):
+                for i,val in enumerate(format_numbers(data)):
                     context[f'exp_{pre}_{i+1}'] = val
                     
             for i,val in enumerate(ind_t_p_data):
@@ -1844,6 +1987,7 @@ class GenerateAnualReportWidget(widgets.VBox):
         save_profile_button.on_click(on_save_profile_button_click)
         continue_button.on_click(on_continue_button_click)
         load_data_button.on_click(on_load_data_button_click)
+        epsa_dropdown.observe(on_annual_epsa_dropdown_change,names='value')
         generate_button.on_click(on_generate_button_click)
         out_name_text.observe(on_out_name_text_change,names='value')
 
@@ -1857,7 +2001,7 @@ class GenerateAnualReportWidget(widgets.VBox):
                 date_picker,
                 widgets.HBox([save_profile_button,intro_help_html,]),
             ]),intro_html]),
-            widgets.VBox([epsa_dropdown,year_dropdown,load_data_help,load_widget,continue_button,load_data_button]),
+            widgets.VBox([ready_html,epsa_dropdown,year_dropdown,load_data_help,load_widget,continue_button,load_data_button]),
         ])
         accordion.set_title(0, '1. Datos Generales / Intro')
         accordion.set_title(1, '2. Cargar Datos')
@@ -1865,7 +2009,7 @@ class GenerateAnualReportWidget(widgets.VBox):
 
         grids = []
         for i in range(3):
-            grids.append(qgrid.QGridWidget(df=pd.DataFrame()))
+            grids.append(qgrid.QGridWidget(df=pd.DataFrame(),precision=2))
 
         qgrid.on('cell_edited',on_cell_edited)
             
@@ -1874,30 +2018,25 @@ class GenerateAnualReportWidget(widgets.VBox):
         tab.set_title(0,'Indicadores Técnicos')
         tab.set_title(1,'Indicadores Económicos')
         tab.set_title(2,'Metas de Expansión')
+        tab.observe(on_tab_change,names='selected_index')
 
-        if not all([exists(path) for path in xl_paths]):
-            load_data_help.value = 'Parece que no cuentas con Datos... Descarga o Actualiza los conjuntos de datos "EPSAS" e "INDICADORES", "VARIABLES" y "POAS" con la siguiente herramienta y luego haz click en el botón "CONTINUAR".'
+        if has_excel_cache():
+            load_data_help.value = 'Se encontraron datos en archivos Excel de una versión anterior. Haz click en el botón "CONTINUAR" para importarlos.'
+            continue_button.layout.display = None
+        elif not data_store.exists(*api_set_keys):
+            load_data_help.value = no_data_help
             load_widget.layout.display = None
             continue_button.layout.display = None
         else:
-            load_data_help.value = ''
-            epsas_help_grid.df = epsas_df = pd.read_excel(epsas_xl_path)
-            indicators_help_grid.df = pd.read_excel(indicators_xl_path)
-            measurements_help_grid.df = pd.read_excel(measurements_xl_path)
-            reports_help_grid.df = pd.read_excel(reports_xl_path)
-
-            sheet_names = ['general','metas expansión']
-            coop_df = pd.concat([pd.read_excel(coop_xl_path,sheet_name=sn) for sn in sheet_names],axis=1)
-            muni_df = pd.concat([pd.read_excel(muni_xl_path,sheet_name=sn) for sn in sheet_names],axis=1)
-            expansion_help_grid.df = coop_df.append(muni_df)
-
-            epsa_dropdown.options = list(epsas_help_grid.df.code)
-            epsa_dropdown.layout.display = None
-            
-            year_dropdown.options = list(measurements_help_grid.df.year.unique())
-            year_dropdown.layout.display = None
-            
-            load_data_button.layout.display = None
+            accordion.observe(on_accordion_change,names='selected_index')
+            start_warm_up([
+                lambda: data_store.read('epsas'),
+                lambda: data_store.derived('indicators','par_text',build_parameter_texts),
+                lambda: data_store.derived('measurements','matrix',build_indicator_matrix),
+                lambda: data_store.key_index('measurements',['epsa','year']).options(),
+                lambda: data_store.key_index('reports',['epsa','year']),
+                lambda: data_store.key_index('poas',['epsa','year','order']),
+            ],ready_html)
             
         children = [
             accordion,